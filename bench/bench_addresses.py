@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Address decoding: legacy double decode vs cached decode_address vs decode_addresses.
+
+Run from the repository root: ``python bench/bench_addresses.py``
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto
+from crypto import MAIN_PUBKEY_HASH, b58decode_check, b58encode_check
+
+
+def legacy_address_to_public_key_hash(address):
+    # What address_to_public_key_hash did before: get_prefix() decoded once, then again.
+    b58decode_check(address)[:1]
+    return b58decode_check(address)[1:]
+
+
+def timed(label, func, n):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print('  {:<28} {:>8.3f}s  {:>7.2f} us/address'.format(label, elapsed, elapsed / n * 1e6))
+
+
+def main(sizes=(10000, 100000)):
+    for n in sizes:
+        # A sendmany list with repeats: 1/4 of the entries are distinct addresses.
+        distinct = [b58encode_check(MAIN_PUBKEY_HASH + os.urandom(20)) for _ in range(n // 4)]
+        addresses = [distinct[i % len(distinct)] for i in range(n)]
+        print('{} addresses ({} distinct)'.format(n, len(distinct)))
+
+        timed('legacy double decode', lambda: [legacy_address_to_public_key_hash(a) for a in addresses], n)
+        crypto.decode_address.cache_clear()
+        timed('decode_address (cold LRU)', lambda: [crypto.address_to_public_key_hash(a) for a in addresses], n)
+        timed('decode_address (warm LRU)', lambda: [crypto.address_to_public_key_hash(a) for a in addresses], n)
+        timed('decode_addresses batch', lambda: crypto.decode_addresses(addresses), n)
+
+        decoded, errors = crypto.decode_addresses(addresses)
+        assert not errors
+        assert [h for _, h in decoded] == [legacy_address_to_public_key_hash(a) for a in addresses]
+
+
+if __name__ == '__main__':
+    main(tuple(int(arg) for arg in sys.argv[1:]) or (10000, 100000))
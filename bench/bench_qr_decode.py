@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""QR frame decode time and memory, legacy RGBA path against the fast path.
+
+Frames are raw RGBA dumps recorded by MyZBarCam on Android (set
+``record_dir``; files are named frame_<n>_<width>x<height>.rgba) or ordinary
+image files laid out the same way, i.e. mirrored as the Android texture is.
+
+Run from the repository root: ``python bench/bench_qr_decode.py FRAMES_DIR``.
+Needs Kivy, Pillow and pyzbar, like the scanner itself.
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageOps
+from pyzbar import pyzbar
+
+from mycamutils import luminance
+
+RAW_NAME = re.compile(r'_(\d+)x(\d+)\.rgba$')
+
+
+def load_frames(directory):
+    """[(name, RGBA bytes, (width, height))] as texture.pixels would hand them over."""
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        match = RAW_NAME.search(name)
+        if match:
+            with open(path, 'rb') as f:
+                frames.append((name, f.read(), (int(match.group(1)), int(match.group(2)))))
+            continue
+        try:
+            image = Image.open(path).convert('RGBA')
+        except OSError:
+            continue
+        frames.append((name, image.tobytes(), image.size))
+    return frames
+
+
+def legacy(pixels, size):
+    # MyZBarCam._decode_pixels on Android: full RGBA image, rotated and mirrored, every symbology.
+    # Returns the codes and the bytes of the Pillow buffers it allocated (not seen by tracemalloc).
+    image = Image.frombytes(mode='RGBA', size=size, data=pixels)
+    rotated = image.rotate(90)
+    mirrored = ImageOps.mirror(rotated)
+    codes = pyzbar.decode(mirrored, symbols=set(pyzbar.ZBarSymbol))
+    # pyzbar converts to 8-bit grayscale before scanning.
+    return codes, 4 * size[0] * size[1] * 3 + size[0] * size[1]
+
+
+def fast(roi=1.0, step=1, transpose=True):
+    def decode(pixels, size):
+        return pyzbar.decode(luminance(pixels, size, roi, step, transpose), symbols=[pyzbar.ZBarSymbol.QRCODE]), 0
+    return decode
+
+
+PATHS = (
+    ('legacy (RGBA, rotate, mirror, all types)', legacy),
+    ('fast, not transposed (mirrored)', fast(transpose=False)),
+    ('fast (gray, transposed, QR only)', fast()),
+    ('fast, centre 60%', fast(roi=0.6)),
+    ('fast, every 2nd pixel', fast(step=2)),
+    ('fast, centre 60%, every 2nd pixel', fast(roi=0.6, step=2)),
+)
+
+
+def run(frames, decode, repeat=3):
+    elapsed = 0.0
+    memory = 0
+    found = 0
+    for _, pixels, size in frames:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            codes, untraced = decode(pixels, size)
+        elapsed += (time.perf_counter() - start) / repeat
+        found += bool(codes)
+        # A separate run for memory, tracing slows the timed ones down.
+        tracemalloc.start()
+        decode(pixels, size)
+        memory += tracemalloc.get_traced_memory()[1] + untraced
+        tracemalloc.stop()
+    return elapsed / len(frames), memory / len(frames), found
+
+
+def main(directory):
+    frames = load_frames(directory)
+    if not frames:
+        sys.exit('no frames in {}'.format(directory))
+    width, height = frames[0][2]
+    print('{} frames, {}x{}'.format(len(frames), width, height))
+    for label, decode in PATHS:
+        elapsed, memory, found = run(frames, decode)
+        print('  {:<42} {:>8.2f} ms {:>9.0f} KiB/frame   decoded {}/{}'.format(
+            label, elapsed * 1000, memory / 1024, found, len(frames)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
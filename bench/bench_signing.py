@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Signatures/sec of python-ecdsa ``sign_deterministic`` vs the secp256k1 comb engine.
+
+Run from the repository root: ``python bench/bench_signing.py [count]``
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import secp256k1
+from bsv_mini import bsv
+
+
+def run(label, func, messages):
+    start = time.perf_counter()
+    sigs = [func(msg) for msg in messages]
+    elapsed = time.perf_counter() - start
+    print('{:<10} {:>9.1f} sig/s  ({} sigs in {:.3f}s)'.format(label, len(messages) / elapsed, len(messages), elapsed))
+    return sigs
+
+
+def main(count=500):
+    key = bsv()
+    messages = [os.urandom(32) for _ in range(count)]
+
+    start = time.perf_counter()
+    secp256k1.get_generator_table()
+    print('table build {:.3f}s'.format(time.perf_counter() - start))
+
+    before = run('ecdsa', key.sign_ecdsa, messages)
+    after = run('comb', key.sign, messages)
+    assert before == after, 'DER signatures differ'
+    print('signatures byte-identical')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Wallet query latency before and after the lookup indexes (migration 6).
+
+Run from the repository root: ``python bench/bench_wallet_db.py [utxos keys]``
+(defaults to 1M UTXO rows and 100k key rows).
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy
+
+from migrations import SCHEMA_VERSION, create_lookup_indexes, migrate
+
+ADDRESS_PAGE = ('SELECT k.id, k."Address", COUNT(u.id), COALESCE(SUM(u.amount), 0) FROM privatekey k '
+                'LEFT OUTER JOIN utxo u ON u."PrivateKey" = k."PrivateKey" '
+                'WHERE k.id < ? AND k."Address" >= ? AND k."Address" < ? GROUP BY k.id ORDER BY k.id DESC LIMIT 50')
+
+
+def prefix_range(prefix):
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+QUERIES = (
+    ('active key', 'SELECT * FROM privatekey WHERE is_activated = ?', lambda keys, txids: (1,)),
+    ('key by address', 'SELECT * FROM privatekey WHERE "Address" = ?', lambda keys, txids: (random.choice(keys)[1],)),
+    ('UTXOs of a key', 'SELECT id, txid, txindex FROM utxo WHERE "PrivateKey" = ?', lambda keys, txids: (random.choice(keys)[0],)),
+    ('history by txid', 'SELECT id FROM txhistory WHERE txid = ?', lambda keys, txids: (random.choice(txids),)),
+    ('history page (keyset)', 'SELECT id, txid, amount, is_recieved FROM txhistory WHERE id < ? ORDER BY id DESC LIMIT 50',
+     lambda keys, txids: (random.randrange(len(txids)),)),
+    ('address page (GROUP BY)', ADDRESS_PAGE, lambda keys, txids: (random.randrange(len(keys)), '', '\x7f')),
+    ('address page (prefix)', ADDRESS_PAGE, lambda keys, txids: (len(keys), *prefix_range(random.choice(keys)[1][:33]))),
+    ('balance (SUM)', 'SELECT SUM(amount) FROM utxo', lambda keys, txids: ()),
+    ('balance (running total)', 'SELECT amount FROM walletbalance WHERE id = 1', lambda keys, txids: ()),
+)
+
+
+def populate(engine, n_utxos, n_keys):
+    keys = [('K{:051x}'.format(i), '1{:033x}'.format(i)) for i in range(n_keys)]
+    txids = ['{:064x}'.format(i) for i in range(n_utxos)]
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany('INSERT INTO privatekey ("PrivateKey", "Address", is_activated, "PublicKey", "PublicKeyHash") '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           [(wif, address, i == n_keys - 1, '02' + '00' * 32, '00' * 20) for i, (wif, address) in enumerate(keys)])
+        cursor.executemany('INSERT INTO utxo ("PrivateKey", txid, txindex, confirmations, amount) VALUES (?, ?, ?, ?, ?)',
+                           ((keys[i % n_keys][0], txids[i], 0, i % 100, 1000 + i % 5000) for i in range(n_utxos)))
+        cursor.executemany('INSERT INTO txhistory (txid, amount, is_recieved) VALUES (?, ?, ?)',
+                           ((txids[i], 1000, True) for i in range(0, n_utxos, 10)))
+        conn.commit()
+    finally:
+        conn.close()
+    return keys, txids[::10]
+
+
+def time_queries(engine, keys, txids, repeat=200):
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for label, sql, params in QUERIES:
+            # Up to ``repeat`` runs, fewer for full scans so each query gets about a second.
+            runs = 0
+            start = time.perf_counter()
+            while runs < repeat and (runs == 0 or time.perf_counter() - start < 1.0):
+                cursor.execute(sql, params(keys, txids)).fetchall()
+                runs += 1
+            elapsed = (time.perf_counter() - start) / runs
+            plan = cursor.execute('EXPLAIN QUERY PLAN ' + sql, params(keys, txids)).fetchall()[-1][-1]
+            print('  {:<24} {:>10.3f} ms   {}'.format(label, elapsed * 1000, plan))
+    finally:
+        conn.close()
+
+
+def main(n_utxos=1000000, n_keys=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlalchemy.create_engine('sqlite:///' + os.path.join(tmp, 'bench.sqlite3'))
+        migrate(engine, target=SCHEMA_VERSION - 1)
+        start = time.perf_counter()
+        keys, txids = populate(engine, n_utxos, n_keys)
+        print('{} UTXO rows, {} key rows (populated in {:.1f}s)'.format(n_utxos, n_keys, time.perf_counter() - start))
+
+        print('schema version {} (no lookup indexes)'.format(SCHEMA_VERSION - 1))
+        time_queries(engine, keys, txids)
+
+        start = time.perf_counter()
+        migrate(engine)
+        print('migration {} ({}) took {:.1f}s'.format(SCHEMA_VERSION, create_lookup_indexes.__name__, time.perf_counter() - start))
+        print('schema version {}'.format(SCHEMA_VERSION))
+        time_queries(engine, keys, txids)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
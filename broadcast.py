@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+import time
+
+import network
+
+# Miner replies that mean the transaction is already in their mempool or chain.
+ALREADY_KNOWN = ('txn-already-known', 'txn-already-in-mempool', 'already in the mempool')
+# Rejections that resubmitting the same transaction cannot fix: its inputs are gone or it is invalid.
+PERMANENT_REJECTIONS = ('missing inputs', 'missing-inputs', 'missingorspent', 'txn-mempool-conflict',
+                        'txn-double-spend-detected', 'script-verify-flag-failed', 'bad-txns', 'dust')
+
+BROADCAST_BATCH = 100  # transactions per submit
+BROADCAST_MAX_ATTEMPTS = 10
+RETRY_BASE = 5  # seconds, doubled on every attempt
+RETRY_MAX = 600
+
+SENT = 'sent'
+RETRY = 'retry'
+FAILED = 'failed'
+
+
+def _mentions(description, markers):
+    description = (description or '').lower()
+    return any(marker in description for marker in markers)
+
+
+def is_already_known(description):
+    return _mentions(description, ALREADY_KNOWN)
+
+
+def is_permanent_rejection(description):
+    return _mentions(description, PERMANENT_REJECTIONS)
+
+
+def classify(return_result, description):
+    """SENT when a miner accepted or already has the transaction, FAILED when it can never be, otherwise RETRY."""
+    if return_result == 'success' or is_already_known(description):
+        return SENT
+    if is_permanent_rejection(description):
+        return FAILED
+    return RETRY
+
+
+def _payload(envelope):
+    payload = envelope['payload']
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    return payload
+
+
+def parse_broadcast_response(result):
+    """(status, description) for a single broadcast_tx response."""
+    data = result.get('data') or {}
+    error = (data.get('error') or {}).get('message')
+    if data.get('minerResponse'):
+        payload = _payload(data['minerResponse'])
+        description = payload.get('resultDescription') or error
+        return classify(payload.get('returnResult'), description), description
+    return classify(None, error), error or json.dumps(result)
+
+
+def parse_batch_response(result):
+    """{txid: (status, description)} for an mAPI /mapi/txs response."""
+    statuses = {}
+    for item in _payload(result)['txs']:
+        description = item.get('resultDescription')
+        statuses[item['txid']] = (classify(item.get('returnResult'), description), description)
+    return statuses
+
+
+def submit_batch(items):
+    """Broadcasts [(txid, rawtx), ...]; returns {txid: (status, description)}.
+
+    Uses the mAPI multi-transaction endpoint when network.MAPI_TXS_URL is set.
+    A transport error only fails the transactions it affected.
+    """
+    if network.MAPI_TXS_URL:
+        try:
+            statuses = parse_batch_response(network.broadcast_txs([rawtx for _, rawtx in items]))
+        except Exception as e:
+            return {txid: (RETRY, str(e)) for txid, _ in items}
+        return {txid: statuses.get(txid, (RETRY, 'missing from batch response')) for txid, _ in items}
+    statuses = {}
+    for txid, rawtx in items:
+        try:
+            statuses[txid] = parse_broadcast_response(network.broadcast_tx(rawtx))
+        except Exception as e:
+            statuses[txid] = (RETRY, str(e))
+    return statuses
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE * 2 ** max(attempts - 1, 0), RETRY_MAX)
+
+
+class BroadcastWorker(threading.Thread):
+    """Background thread draining a durable outbox.
+
+    ``store`` provides ``due(now, limit)`` -> [(txid, rawtx), ...],
+    ``record(statuses, now)`` and ``next_due()`` -> unix time or None.
+    Call ``wake()`` after enqueueing so new transactions go out at once.
+    """
+
+    def __init__(self, store, submit=submit_batch, batch_size=BROADCAST_BATCH, clock=time.time):
+        super().__init__(name='broadcast', daemon=True)
+        self.store = store
+        self.submit = submit
+        self.batch_size = batch_size
+        self.clock = clock
+        self._wakeup = threading.Event()
+        self._stopping = False
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def run_once(self):
+        """Submits one batch of due transactions; returns how many were submitted."""
+        items = self.store.due(self.clock(), self.batch_size)
+        if items:
+            self.store.record(self.submit(items), self.clock())
+        return len(items)
+
+    def run(self):
+        while not self._stopping:
+            # Cleared before draining, so a wake() during submit is not lost.
+            self._wakeup.clear()
+            timeout = None
+            try:
+                if self.run_once() == self.batch_size:
+                    continue
+                next_due = self.store.next_due()
+                if next_due is not None:
+                    timeout = max(next_due - self.clock(), 0)
+            except Exception:
+                logging.exception('broadcast worker')
+                timeout = RETRY_BASE
+            self._wakeup.wait(timeout)
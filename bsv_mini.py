@@ -1,8 +1,9 @@
 import secrets
-import ecdsa
 import hashlib
+from functools import lru_cache
 #import base58
-from crypto import b58encode,b58decode_check,b58encode_check,bytes_to_wif,public_key_to_address
+from crypto import b58encode,b58decode_check,b58encode_check,bytes_to_wif,public_key_to_address,ripemd160_sha256,MAIN_PUBKEY_HASH
+import secp256k1
 
 
 maxval='fffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141'
@@ -20,6 +21,7 @@ class bsv():
             elif extended_privatekey[-1:] != b'\x01':
                 print('not compressed key')
             else:
+                import ecdsa  # loaded on first use, it is not needed at startup
                 self.PrivateKey = ecdsa.SigningKey.from_string(extended_privatekey[1:][:-1], curve=ecdsa.SECP256k1)
                 self.public_key = self.to_public_key_compressed()
                 self.address = self.to_address()
@@ -29,6 +31,7 @@ class bsv():
     def new_privkey(self):
         pk_num = secrets.randbelow(maxval_int)+1
         pk_hex = format(pk_num, '064x')
+        import ecdsa
         PrivateKey=ecdsa.SigningKey.from_string(bytes.fromhex(pk_hex), curve=ecdsa.SECP256k1)
         return PrivateKey
 
@@ -45,6 +48,9 @@ class bsv():
     def to_hex(self):
         return self.PrivateKey.to_string().hex()
     
+    def to_public_key_hash(self):
+        return ripemd160_sha256(bytes.fromhex(self.public_key))
+
     def to_wif(self):
         wif = bytes_to_wif(self.PrivateKey.to_string(),prefix='main', compressed=True)
         return wif
@@ -55,9 +61,90 @@ class bsv():
             return bsv(wif=wif)
     
     def sign(self,msg):
+        return secp256k1.sign(self.PrivateKey.privkey.secret_multiplier,msg)
+
+    def sign_ecdsa(self,msg):
+        import ecdsa
         return self.PrivateKey.sign_deterministic(msg,hashfunc=hashlib.sha256,sigencode=ecdsa.util.sigencode_der_canonize)
-    
-    
 
 
+# Number of parsed keys kept by key_handle().
+KEY_CACHE_SIZE = 1024
+
+
+class KeyHandle:
+    """A mainnet compressed key parsed from its WIF once.
+
+    The public key, hash160, address and P2PKH scriptCode are derived on
+    first access and memoized. ``public_key`` and ``hash160`` are raw bytes
+    and may be passed in when already known (e.g. from PrivateKeyList).
+    """
+    __slots__ = ('wif', '_secret', '_public_key', '_hash160', '_address', '_script_code')
+
+    def __init__(self, wif, public_key=None, hash160=None):
+        self.wif = wif
+        self._secret = None
+        self._public_key = public_key
+        self._hash160 = hash160
+        self._address = None
+        self._script_code = None
+
+    def __repr__(self):
+        return "<KeyHandle: "+self.address + ">"
+
+    @property
+    def secret(self):
+        if self._secret is None:
+            extended_privatekey = b58decode_check(self.wif)
+            if extended_privatekey[:1] != b'\x80':
+                raise ValueError('not mainnet key')
+            if len(extended_privatekey) != 34 or extended_privatekey[-1:] != b'\x01':
+                raise ValueError('not compressed key')
+            self._secret = int.from_bytes(extended_privatekey[1:33], 'big')
+        return self._secret
+
+    @property
+    def public_key(self):
+        if self._public_key is None:
+            self._public_key = secp256k1.public_key_compressed(self.secret)
+        return self._public_key
+
+    @property
+    def hash160(self):
+        if self._hash160 is None:
+            self._hash160 = ripemd160_sha256(self.public_key)
+        return self._hash160
+
+    @property
+    def address(self):
+        if self._address is None:
+            self._address = b58encode_check(MAIN_PUBKEY_HASH + self.hash160)
+        return self._address
+
+    @property
+    def script_code(self):
+        # OP_DUP OP_HASH160 <hash160> OP_EQUALVERIFY OP_CHECKSIG
+        if self._script_code is None:
+            self._script_code = b'\x76\xa9\x14' + self.hash160 + b'\x88\xac'
+        return self._script_code
+
+    def sign(self, msg):
+        return secp256k1.sign(self.secret, msg)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _cached_key_handle(wif):
+    return KeyHandle(wif)
+
+
+def key_handle(wif, public_key=None, hash160=None):
+    """Returns the cached KeyHandle for ``wif`` (LRU of KEY_CACHE_SIZE, safe to share between threads).
 
+    ``public_key`` and ``hash160`` fill in whichever the handle has not derived yet.
+    """
+    handle = _cached_key_handle(wif)
+    if public_key is not None and handle._public_key is None:
+        handle._public_key = public_key
+    if hash160 is not None and handle._hash160 is None:
+        handle._hash160 = hash160
+    return handle
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import math
+import random
+from bisect import bisect_left
+
+from exceptions import InsufficientFunds
+from fees import DUST, P2PKH_INPUT_SIZE, P2PKH_OUTPUT_SIZE, fee_for_size, transaction_size
+
+BNB_MAX_TRIES = 100000
+KNAPSACK_ITERATIONS = 1000
+# Knapsack only samples the largest candidates, fewer inputs means fewer signatures.
+KNAPSACK_MAX_POOL = 200
+
+
+class SelectionParams:
+    """What a selection has to pay for: ``target`` sats to ``n_outputs`` outputs at ``fee_rate`` sat/B.
+
+    ``outputs_size`` is the serialized size of those outputs (P2PKH by default).
+    """
+    __slots__ = ('target', 'fee_rate', 'n_outputs', 'outputs_size', 'dust')
+
+    def __init__(self, target, fee_rate, n_outputs=1, outputs_size=None, dust=DUST):
+        self.target = target
+        self.fee_rate = fee_rate
+        self.n_outputs = n_outputs
+        self.outputs_size = n_outputs * P2PKH_OUTPUT_SIZE if outputs_size is None else outputs_size
+        self.dust = dust
+
+    def fee(self, n_inputs, change=False):
+        size = transaction_size(n_inputs, n_inputs * P2PKH_INPUT_SIZE,
+                                self.n_outputs + (1 if change else 0),
+                                self.outputs_size + (P2PKH_OUTPUT_SIZE if change else 0))
+        return fee_for_size(size, self.fee_rate)
+
+    @property
+    def input_fee(self):
+        return P2PKH_INPUT_SIZE * self.fee_rate
+
+    @property
+    def cost_of_change(self):
+        # Creating the change output now plus spending it later.
+        return (P2PKH_OUTPUT_SIZE + P2PKH_INPUT_SIZE) * self.fee_rate
+
+
+class Selection:
+    """Chosen UTXOs; ``fee`` is everything not paid to the target or to ``change``."""
+    __slots__ = ('utxos', 'fee', 'change')
+
+    def __init__(self, utxos, fee, change):
+        self.utxos = utxos
+        self.fee = fee
+        self.change = change
+
+    def __repr__(self):
+        return 'Selection({} inputs, fee={}, change={})'.format(len(self.utxos), self.fee, self.change)
+
+    @property
+    def amount(self):
+        return sum(utxo['amount'] for utxo in self.utxos)
+
+
+class UtxoView:
+    """UTXO dicts indexed by amount (ascending)."""
+    __slots__ = ('utxos', 'amounts', 'total')
+
+    def __init__(self, utxosets):
+        self.utxos = sorted(utxosets, key=lambda utxo: utxo['amount'])
+        self.amounts = [utxo['amount'] for utxo in self.utxos]
+        self.total = sum(self.amounts)
+
+    def __len__(self):
+        return len(self.utxos)
+
+    def smallest_at_least(self, amount):
+        index = bisect_left(self.amounts, amount)
+        if index < len(self.utxos):
+            return self.utxos[index]
+        return None
+
+    def below(self, amount):
+        return self.utxos[:bisect_left(self.amounts, amount)]
+
+    def largest_first(self):
+        return reversed(self.utxos)
+
+
+def finalize(params, utxos):
+    """Prices ``utxos`` against ``params``; None if they do not cover target plus fee."""
+    if not utxos:
+        return None
+    total = sum(utxo['amount'] for utxo in utxos)
+    fee = params.fee(len(utxos), change=True)
+    change = total - params.target - fee
+    if change > params.dust:
+        return Selection(utxos, fee, change)
+    # Leftover below dust goes to the miner.
+    if total - params.target >= params.fee(len(utxos)):
+        return Selection(utxos, total - params.target, 0)
+    return None
+
+
+def select_largest_first(view, params):
+    selected = []
+    total = 0
+    for utxo in view.largest_first():
+        selected.append(utxo)
+        total += utxo['amount']
+        if total >= params.target + params.fee(len(selected)):
+            return selected
+    return None
+
+
+def select_bnb(view, params):
+    """Branch-and-bound search for a change-free exact match.
+
+    Looks for a subset whose effective value (amount minus its own input fee)
+    lands within ``cost_of_change`` above target plus base fee, preferring the
+    fewest inputs. Gives up after BNB_MAX_TRIES steps.
+    """
+    input_fee = params.input_fee
+    pool = [utxo for utxo in view.largest_first() if utxo['amount'] > input_fee]
+    values = [utxo['amount'] - input_fee for utxo in pool]
+    low = params.target + params.fee(0)
+    high = low + params.cost_of_change
+
+    available = sum(values)
+    if available < low:
+        return None
+
+    best = None
+    best_key = None
+    selected = []
+    value = 0
+    depth = 0
+    n = len(values)
+    for _ in range(BNB_MAX_TRIES):
+        if value + available < low or value > high:
+            backtrack = True
+        elif value >= low:
+            key = (len(selected), value - low)
+            if best_key is None or key < best_key:
+                best = list(selected)
+                best_key = key
+            backtrack = True
+        elif depth == n or (best_key is not None and len(selected) + 1 > best_key[0]):
+            backtrack = True
+        else:
+            # Include the next candidate first.
+            available -= values[depth]
+            value += values[depth]
+            selected.append(depth)
+            depth += 1
+            continue
+
+        if not selected:
+            break
+        # Exclude the most recently included candidate and restore the rest.
+        last = selected.pop()
+        value -= values[last]
+        while depth > last + 1:
+            depth -= 1
+            available += values[depth]
+
+    if best is None:
+        return None
+    return [pool[i] for i in best]
+
+
+def _approximate_best_subset(values, target, rng):
+    n = len(values)
+    best = [True] * n
+    best_total = sum(values)
+    for _ in range(KNAPSACK_ITERATIONS):
+        if best_total == target:
+            break
+        included = [False] * n
+        total = 0
+        reached = False
+        for npass in range(2):
+            if reached:
+                break
+            for i in range(n):
+                # First pass picks at random, second pass fills in the rest.
+                if (rng.random() < 0.5 if npass == 0 else not included[i]):
+                    total += values[i]
+                    included[i] = True
+                    if total >= target:
+                        reached = True
+                        if total < best_total:
+                            best_total = total
+                            best = list(included)
+                        total -= values[i]
+                        included[i] = False
+    return best, best_total
+
+
+def select_knapsack(view, params):
+    """Bitcoin Core style knapsack, seeded for reproducibility.
+
+    The smallest UTXO that covers target plus fee and minimum change is used on
+    its own when there is one; otherwise a random-subset approximation over the
+    largest KNAPSACK_MAX_POOL smaller UTXOs looks for the least overshoot.
+    """
+    need = params.target + params.fee(0, change=True)
+    min_change = params.dust + 1
+    input_fee = params.input_fee
+
+    # A single covering UTXO beats any multi-input subset on signing cost.
+    threshold = math.ceil(need + min_change + input_fee)
+    lowest_larger = view.smallest_at_least(threshold)
+    if lowest_larger is not None:
+        return [lowest_larger]
+
+    smaller = [utxo for utxo in view.below(threshold) if utxo['amount'] > input_fee]
+    smaller = smaller[::-1][:KNAPSACK_MAX_POOL]
+    values = [utxo['amount'] - input_fee for utxo in smaller]
+    total_smaller = sum(values)
+    if total_smaller == need:
+        return smaller
+    if total_smaller < need:
+        return None
+
+    rng = random.Random(params.target)
+    best, best_total = _approximate_best_subset(values, need, rng)
+    if best_total != need and total_smaller >= need + min_change:
+        best, best_total = _approximate_best_subset(values, need + min_change, rng)
+
+    return [utxo for utxo, included in zip(smaller, best) if included]
+
+
+STRATEGIES = {
+    'bnb': select_bnb,
+    'knapsack': select_knapsack,
+    'largest_first': select_largest_first,
+}
+
+# Tried in order; the first strategy that yields a fundable selection wins.
+DEFAULT_STRATEGIES = ('bnb', 'knapsack', 'largest_first')
+
+
+def select_coins(utxosets, target, fee_rate, n_outputs=1, outputs_size=None, strategies=DEFAULT_STRATEGIES):
+    """Picks the UTXOs that pay ``target`` sats plus fee.
+
+    ``strategies`` are names from STRATEGIES or callables taking
+    (UtxoView, SelectionParams) and returning a list of UTXO dicts or None.
+    """
+    view = utxosets if isinstance(utxosets, UtxoView) else UtxoView(utxosets)
+    params = SelectionParams(target, fee_rate, n_outputs, outputs_size)
+    for strategy in strategies:
+        if not callable(strategy):
+            strategy = STRATEGIES[strategy]
+        selection = finalize(params, strategy(view, params))
+        if selection is not None:
+            return selection
+    raise InsufficientFunds('Balance {} is less than {} (including fee).'.format(
+        view.total, target + params.fee(len(view))))
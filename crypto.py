@@ -4,6 +4,7 @@
 
 from hashlib import new, sha256 as _sha256
 from collections import deque
+from functools import lru_cache
 from utils import int_to_unknown_bytes
 
 def sha256(bytestr):
@@ -113,21 +114,68 @@ PUBLIC_KEY_COMPRESSED_ODD_Y = b'\x03'
 PRIVATE_KEY_COMPRESSED_PUBKEY = b'\x01'
 
 
-def address_to_public_key_hash(address):
-    get_prefix(address)
-    return b58decode_check(address)[1:]
+# Number of decoded addresses kept by decode_address().
+ADDRESS_CACHE_SIZE = 4096
 
+_ADDRESS_PREFIXES = {MAIN_PUBKEY_HASH: 'main', TEST_PUBKEY_HASH: 'test'}
 
-def get_prefix(address):
-    prefix = b58decode_check(address)[:1]
 
-    if prefix == MAIN_PUBKEY_HASH:
-        return 'main'
-    elif prefix == TEST_PUBKEY_HASH:
-        return 'test'
-    else:
+def _decode_address(address):
+    decoded = b58decode_check(address)
+    prefix = decoded[:1]
+
+    if prefix not in _ADDRESS_PREFIXES:
         raise ValueError('{} does not correspond to a mainnet nor '
                          'testnet address.'.format(prefix))
+    if len(decoded) != 21:
+        raise ValueError('"{}" does not hold a 20-byte public key hash.'.format(address))
+
+    return _ADDRESS_PREFIXES[prefix], decoded[1:]
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def decode_address(address):
+    """Returns (network, hash160) for a P2PKH address, decoding it only once."""
+    return _decode_address(address)
+
+
+def decode_addresses(addresses):
+    """Validates and decodes a batch of addresses (e.g. a sendmany CSV).
+
+    Duplicates are decoded once and the shared LRU is left untouched, so a
+    large batch does not evict the wallet's hot addresses. Returns a list of
+    (network, hash160) aligned with ``addresses`` and a list of
+    (index, address, error message) for the entries that failed.
+    """
+    seen = {}
+    decoded = []
+    errors = []
+    append = decoded.append
+    decode = _decode_address
+
+    for index, address in enumerate(addresses):
+        result = seen.get(address)
+        if result is None:
+            try:
+                result = decode(address)
+            except ValueError as e:
+                result = e
+            seen[address] = result
+        if isinstance(result, ValueError):
+            errors.append((index, address, str(result)))
+            append(None)
+        else:
+            append(result)
+
+    return decoded, errors
+
+
+def address_to_public_key_hash(address):
+    return decode_address(address)[1]
+
+
+def get_prefix(address):
+    return decode_address(address)[0]
 
 
 def bytes_to_wif(private_key, prefix='main', compressed=False):
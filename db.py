@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""SQLite access for the wallet: WAL mode, one writer thread, reads anywhere.
+
+In WAL mode readers never wait for the writer, so UI reads use their own
+connections while every write goes through DBWriter, which owns the only
+writing session and commits queued jobs in groups.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+import sqlalchemy
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),  # durable at checkpoints; enough for WAL
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -16000),  # KiB
+)
+
+GROUP_COMMIT_MAX = 64  # jobs per transaction
+GROUP_COMMIT_WINDOW = 0.005  # seconds to wait for more jobs before committing
+
+
+def create_wallet_engine(path, pragmas=SQLITE_PRAGMAS):
+    engine = sqlalchemy.create_engine('sqlite:///' + path, echo=False)
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+
+    return engine
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'future')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.future = Future()
+
+
+class DBWriter(threading.Thread):
+    """Runs every write on one thread.
+
+    ``submit(func, *args)`` queues ``func(session, *args)`` and returns a
+    Future for its result. Jobs arriving within ``window`` seconds of each
+    other share one commit; if any of them fails, the group is rolled back
+    and replayed one job per transaction so only the failing job errors.
+    """
+
+    def __init__(self, session_factory, max_batch=GROUP_COMMIT_MAX, window=GROUP_COMMIT_WINDOW):
+        super().__init__(name='dbwriter', daemon=True)
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = queue.Queue()
+
+    def submit(self, func, *args):
+        job = _Job(func, args)
+        self._queue.put(job)
+        return job.future
+
+    def stop(self):
+        self._queue.put(None)
+
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get(timeout=self.window)
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _commit(self, batch):
+        session = self.session_factory()
+        try:
+            results = [job.func(session, *job.args) for job in batch]
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(batch) > 1:
+                for job in batch:
+                    self._commit([job])
+            else:
+                batch[0].future.set_exception(e)
+            return
+        finally:
+            session.close()
+        for job, result in zip(batch, results):
+            job.future.set_result(result)
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            if batch:
+                try:
+                    self._commit(batch)
+                except Exception:
+                    logging.exception('database writer')
@@ -3,3 +3,11 @@
 
 class InsufficientFunds(Exception):
     pass
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body, url=None):
+        super().__init__('HTTP {} from {}'.format(status, url))
+        self.status = status
+        self.body = body
+        self.url = url
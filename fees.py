@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import logging
+import math
+import time
+
+from exceptions import InsufficientFunds
+from network import get_fee_quote
+from utils import int_to_varint
+
+# The dust is described in bitcoin-sv/src/primitives/transaction.h
+DUST = 546
+
+# Used until the first fee quote arrives, and whenever fetching one fails.
+DEFAULT_FEE_RATE = 0.5  # sat/B
+FEE_QUOTE_TTL = 600  # seconds
+FEE_QUOTE_RETRY = 60  # seconds before retrying a failed fetch
+
+# push + low-s DER signature (<= 71 bytes) + sighash byte, push + compressed public key
+P2PKH_SCRIPT_SIG_MAX = 1 + 72 + 1 + 33
+P2PKH_SCRIPT_SIZE = 25
+
+
+def input_size(script_sig_len=P2PKH_SCRIPT_SIG_MAX):
+    return 32 + 4 + len(int_to_varint(script_sig_len)) + script_sig_len + 4
+
+
+def output_size(script_len=P2PKH_SCRIPT_SIZE):
+    return 8 + len(int_to_varint(script_len)) + script_len
+
+
+P2PKH_INPUT_SIZE = input_size()  # 148
+P2PKH_OUTPUT_SIZE = output_size()  # 34
+
+
+def transaction_size(n_inputs, inputs_size, n_outputs, outputs_size):
+    """Exact serialized size given the summed sizes of the inputs and outputs."""
+    return (
+        4  # version
+        + len(int_to_varint(n_inputs))
+        + inputs_size
+        + len(int_to_varint(n_outputs))
+        + outputs_size
+        + 4  # time lock
+    )
+
+
+def fee_for_size(size, fee_rate):
+    return math.ceil(size * fee_rate)
+
+
+def settle_fee(input_amount, n_inputs, outputs, fee_rate, inputs_size=None,
+               change_size=P2PKH_OUTPUT_SIZE, dust=DUST):
+    """Fee and change for spending ``input_amount`` to ``outputs`` (TxOut list).
+
+    Starts without change and adds a change output while the leftover can pay
+    for it and stay above dust, recomputing until the fee no longer moves.
+    Inputs are assumed to be P2PKH unless ``inputs_size`` is given.
+    Returns (fee, change); change 0 means no change output.
+    """
+    if inputs_size is None:
+        inputs_size = n_inputs * P2PKH_INPUT_SIZE
+    paid = sum(txout.amount for txout in outputs)
+    outputs_size = sum(output_size(len(txout.script)) for txout in outputs)
+
+    change = 0
+    while True:
+        n_outputs = len(outputs) + (1 if change else 0)
+        size = transaction_size(n_inputs, inputs_size, n_outputs,
+                                outputs_size + (change_size if change else 0))
+        fee = fee_for_size(size, fee_rate)
+        leftover = input_amount - paid - fee
+        if leftover < 0:
+            raise InsufficientFunds('Balance {} is less than {} (including fee).'.format(input_amount, paid + fee))
+        if change:
+            if leftover > dust:
+                if leftover == change:
+                    return fee, change
+                change = leftover
+                continue
+            # Change does not survive its own fee, give it to the miner instead.
+            return input_amount - paid, 0
+        with_change = transaction_size(n_inputs, inputs_size, n_outputs + 1, outputs_size + change_size)
+        if leftover - (fee_for_size(with_change, fee_rate) - fee) > dust:
+            change = leftover
+            continue
+        return input_amount - paid, 0
+
+
+def parse_fee_quote(response):
+    """Standard mining fee in sat/B from an mAPI feeQuote response."""
+    payload = response['payload']
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    for fee in payload['fees']:
+        if fee['feeType'] == 'standard':
+            return fee['miningFee']['satoshis'] / fee['miningFee']['bytes']
+    raise ValueError('no standard fee in fee quote')
+
+
+class FeeQuoteCache:
+    """Holds the last mAPI fee rate for ``ttl`` seconds.
+
+    ``rate()`` only calls ``fetch`` once the cached quote has expired, so
+    building transactions does not touch the network while it is fresh.
+    """
+    __slots__ = ('fetch', 'ttl', 'default_rate', 'clock', '_rate', '_expires')
+
+    def __init__(self, fetch=get_fee_quote, ttl=FEE_QUOTE_TTL, default_rate=DEFAULT_FEE_RATE, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.default_rate = default_rate
+        self.clock = clock
+        self._rate = None
+        self._expires = 0
+
+    def rate(self):
+        now = self.clock()
+        if now < self._expires:
+            return self._rate
+        try:
+            self._rate = parse_fee_quote(self.fetch())
+            self._expires = now + self.ttl
+        except Exception as e:
+            logging.warning('fee quote unavailable: {}'.format(e))
+            if self._rate is None:
+                self._rate = self.default_rate
+            self._expires = now + min(self.ttl, FEE_QUOTE_RETRY)
+        return self._rate
+
+    def invalidate(self):
+        self._expires = 0
+
+
+fee_quotes = FeeQuoteCache()
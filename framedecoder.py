@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+MIN_INTERVAL = 1 / 30  # seconds between decodes; no point exceeding the preview rate
+MAX_INTERVAL = 0.5
+LOAD_FACTOR = 2  # interval = latency * LOAD_FACTOR, so decoding takes at most half a core
+LATENCY_SMOOTHING = 0.3  # weight of the newest sample in the latency average
+
+
+class FrameDecoder(threading.Thread):
+    """Decodes camera frames off the UI thread.
+
+    The UI thread asks ``wants_frame()`` before reading a frame's pixels and
+    then ``submit``s it. There is a single slot: a frame still waiting when a
+    newer one arrives is dropped, so the decoder always works on the latest
+    frame and never builds a backlog. ``decode(frame)`` runs on this thread
+    and its result is passed to ``on_result`` (also on this thread; widgets
+    should repost it with Clock). The decode rate follows measured latency.
+    """
+
+    def __init__(self, decode, on_result, clock=time.monotonic):
+        super().__init__(name='framedecoder', daemon=True)
+        self.decode = decode
+        self.on_result = on_result
+        self.clock = clock
+        self.latency = 0.0
+        self.interval = MIN_INTERVAL
+        self.decoded = 0
+        self.dropped = 0
+        self._next_at = 0.0
+        self._frame = None
+        self._stopping = False
+        self._cond = threading.Condition()
+
+    def wants_frame(self):
+        """False while the rate limit says to skip this frame, so its pixels need not be read."""
+        return self.clock() >= self._next_at
+
+    def submit(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._next_at = self.clock() + self.interval
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._frame = None
+            self._cond.notify()
+
+    def _measure(self, latency):
+        if self.decoded:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        else:
+            self.latency = latency
+        self.interval = min(max(self.latency * LOAD_FACTOR, MIN_INTERVAL), MAX_INTERVAL)
+        self.decoded += 1
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._frame is None and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    break
+                frame, self._frame = self._frame, None
+            start = self.clock()
+            try:
+                result = self.decode(frame)
+            except Exception:
+                logging.exception('frame decoder')
+                continue
+            finally:
+                self._measure(self.clock() - start)
+            if not self._stopping:
+                self.on_result(result)
@@ -9,78 +9,54 @@ from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.recycleview import RecycleView
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.gridlayout import GridLayout
+from kivy.uix.behaviors import ButtonBehavior
 #from kivy.properties import NumericProperty,ObjectProperty
-from bsv_mini import bsv
+from bsv_mini import bsv, key_handle
 #from kivy.uix.camera import Camera
-from kivy.garden.qrcode import QRCodeWidget
 from kivy.core.window import Window
-from myzbarcam import MyZBarCam
-from kivy_garden.xcamera import XCamera
-import ast
 import re
 import os
+import sys
 import json
-import sqlalchemy
-from sqlalchemy import and_, or_, not_
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Boolean, ForeignKey, UniqueConstraint, bindparam
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-import webbrowser
-from transaction import get_rawtx_to_pay, create_transaction, sweep, confirm_deposit
-from network import broadcast_tx
+# The wallet database (and SQLAlchemy with it) is imported by the handlers that
+# need it, so the first frame does not wait for it.
 import time
+from concurrent.futures import ThreadPoolExecutor
+from kivy.clock import Clock
+from kivy.properties import StringProperty
+from pages import KeysetPager
 
-Base = declarative_base()
-
-class UTXO(Base):
-    __tablename__ = 'utxo'
-    __table_args__ = (sqlalchemy.schema.UniqueConstraint('txid', 'txindex', name='uix_1'),)
- 
-    id = Column(Integer, primary_key=True)
-    PrivateKey = Column(String)
-    txid = Column(String)
-    txindex = Column(Integer)
-    confirmations = Column(Integer)
-    amount = Column(Integer)
-
-class PrivateKeyList(Base):
-    __tablename__ = 'privatekey'
-
-    id = Column(Integer, primary_key=True)
-    PrivateKey = Column(String)
-    Address = Column(String)
-    is_activated = Column(Boolean, unique=False)
-
-class TxHistory(Base):
-    __tablename__ = 'txhistory'
-    
-    id = Column(Integer, primary_key=True)
-    txid = Column(String)
-    amount = Column(Integer)
-    rawtx = Column(String)
-    is_recieved = Column(Boolean, unique=False)  #True : Recieve  False: Pay
-
-
-app_path = os.path.dirname(os.path.abspath(__file__))
-print(app_path)
-engine = create_engine('sqlite:///'+os.path.join(app_path, 'simplewallet.sqlite3'), echo=False)
-Session = sessionmaker(bind = engine)
-session = Session()
-
-def init_db():
-    Base.metadata.create_all(engine)
-    ini_prik = bsv()
-    session.bulk_insert_mappings(PrivateKeyList,[{'PrivateKey': ini_prik.to_wif(),'Address': ini_prik.address,'is_activated': True}])
-    session.commit()
-
-if not os.path.exists(os.path.join(app_path, 'simplewallet.sqlite3')):
-    init_db()
-    
+# Network and signing work started from UI handlers, kept off the UI thread.
+io_executor = ThreadPoolExecutor(max_workers=2)
+# Payments select coins from the wallet's current UTXOs, so they are built one at a time.
+payment_executor = ThreadPoolExecutor(max_workers=1)
+
+def then(future, callback):
+    """Calls ``callback(future)`` on the UI thread once ``future`` is done."""
+    def done(future):
+        Clock.schedule_once(lambda dt: callback(future))
+    future.add_done_callback(done)
+    return future
+
+def report(future):
+    import wallet
+    wallet.session.expire_all()  # the writer may have changed rows this session holds
+    if future.exception() is not None:
+        print(future.exception())
+    else:
+        print(future.result())
 
-def get_recieve_address():
-    result = session.query(PrivateKeyList).filter_by(is_activated=True).one()
-    return result.Address
+
+# Seconds after startup before pending broadcasts are resumed.
+BROADCAST_START_DELAY = 2
+
+def resume_broadcasts():
+    import wallet
+    wallet.get_broadcast_worker()
+
+def open_tx(txid):
+    import webbrowser  # only needed once a transaction is tapped
+    webbrowser.open('https://whatsonchain.com/tx/'+txid)
 
 
 
@@ -98,18 +74,12 @@ class HistoryScreen(Screen):
     balance = 0
     def __init__(self, **kwargs):
         super(HistoryScreen, self).__init__(**kwargs)
-        result = session.query(UTXO).all()
-        utxosets = [item.__dict__.copy() for item in result]
-        self.balance = 0
-        for item in utxosets:
-            self.balance += item['amount']
+        # Loaded after the first frame so opening the wallet does not delay startup.
+        Clock.schedule_once(lambda dt: self.update_balance())
     
     def update_balance(self):
-        result = session.query(UTXO).all()
-        utxosets = [item.__dict__.copy() for item in result]
-        self.balance = 0
-        for item in utxosets:
-            self.balance += item['amount']
+        import wallet
+        self.balance = wallet.get_balance()
         self.ids.balance.text = 'Balance: '+str(self.balance) +' sats   (TOUCH TO REFRESH)'
         
     
@@ -117,41 +87,44 @@ class HistoryScreen(Screen):
         self.ids.button.text = bsv().address
 
 class QRAddressScreen(Screen):
-    address = get_recieve_address()
+    address = StringProperty('')
+    qr = None
+
+    def on_pre_enter(self):
+        if self.qr is None:
+            # The QR encoder is loaded the first time an address is shown.
+            from kivy.garden.qrcode import QRCodeWidget
+            self.qr = QRCodeWidget(data=self.address or self.get_recieve_address())
+            self.bind(address=self.qr.setter('data'))
+            self.ids.qr_box.add_widget(self.qr)
+        if not self.address:
+            self.address = self.get_recieve_address()
 
     def get_new_address(self):
-        result = session.query(PrivateKeyList).filter_by(is_activated=True).one()
-        result.is_activated = False
-        session.add(result)
-        prik = bsv()
-        session.bulk_insert_mappings(PrivateKeyList,[{'PrivateKey': prik.to_wif(),'Address': prik.address,'is_activated': True}])
-        session.commit()
-        self.address = get_recieve_address()
-        self.ids.qr.data = self.address
-        self.ids.recieve_address.text = self.address
-        return self.address
+        import wallet
+        return then(wallet.get_db_writer().submit(wallet.rotate_receive_key), self.show_address)
+
+    def show_address(self, future):
+        self.address = future.result()
 
     def get_recieve_address(self):
-        result = session.query(PrivateKeyList).filter_by(is_activated=True).one()
-        return result.Address
+        import wallet
+        return wallet.get_recieve_address()
 
     def confirm_button(self):
-        address = self.ids.recieve_address.text
-        utxosets = confirm_deposit(address)
-        key_query = session.query(PrivateKeyList).filter_by(Address=address).one()
+        import wallet
+        address = self.address
+        key_query = wallet.session.query(wallet.PrivateKeyList).filter_by(Address=address).one()
         prik = key_query.__dict__.copy()
-        print(prik['PrivateKey'])
-        for item in utxosets:
-            item['PrivateKey'] = prik['PrivateKey']
-            query = session.query(UTXO).filter(and_(UTXO.txid==item['txid'],UTXO.txindex==item['txindex'])).all()
-            if query:
-                print(query[0].__dict__)
-                pass
-            else:
-                session.bulk_insert_mappings(UTXO,[item])
-                item['is_recieved'] = True
-                session.bulk_insert_mappings(TxHistory,[item])
-                session.commit()
+        return then(io_executor.submit(self.confirm, address, prik['PrivateKey']), report)
+
+    @staticmethod
+    def confirm(address, private_key):
+        import wallet
+        from transaction import confirm_deposit
+        utxosets = confirm_deposit(address)
+        new = wallet.get_db_writer().submit(wallet.ingest_deposits, utxosets, private_key).result()
+        return '{} new of {} deposits'.format(len(new), len(utxosets))
             
         
 
@@ -160,113 +133,141 @@ class QRAddressScreen(Screen):
 
     
 class AddressListScreen(Screen):
-    def resync_button(self):
-        keylist = session.query(PrivateKeyList).order_by(PrivateKeyList.id.desc()).all()
-        key_address_list = [(key.__dict__['PrivateKey'],key.__dict__['Address']) for key in keylist]
-        print(key_address_list)
-        session.query(UTXO).delete()
-        for key_address in key_address_list:
-            prik = key_address[0]
-            print(prik)
-            address = key_address[1]
-            utxosets = confirm_deposit(address)
-            if utxosets:
-                for item in utxosets:
-                    item['PrivateKey'] = prik
-                session.bulk_insert_mappings(UTXO,[item])
-                session.commit()
-            time.sleep(0.5)
-
-class AddressListView(GridLayout):
-    
+    def resync_button(self, full=False):
+        return then(io_executor.submit(self.resync, full), report)
+
+    @staticmethod
+    def resync(full=False):
+        import wallet
+        from sync import fetch_unspents, needs_sync
+        now = time.time()
+        with wallet.new_session() as db:
+            keylist = db.query(wallet.PrivateKeyList.PrivateKey, wallet.PrivateKeyList.Address, wallet.PrivateKeyList.is_activated,
+                               wallet.AddressSyncState).outerjoin(
+                wallet.AddressSyncState, wallet.AddressSyncState.Address == wallet.PrivateKeyList.Address).order_by(
+                wallet.PrivateKeyList.id.desc()).all()
+            # Addresses with a pending broadcast keep their local state until it is sent; apply_resync
+            # checks again for payments queued during the fetch.
+            pending = wallet.pending_addresses(db)
+            due = [(prik, address) for prik, address, is_activated, state in keylist
+                   if address not in pending and (full or needs_sync(state, is_activated, now))]
+        unspents = fetch_unspents([address for _, address in due])
+        # The diff and the new cursors are applied in one transaction.
+        inserted, removed = wallet.get_db_writer().submit(wallet.apply_resync, due, unspents, now).result()
+        return 'resynced {} addresses: {} new, {} spent UTXOs'.format(len(due), inserted, removed)
+
+class PagedView(RecycleView):
+    """A RecycleView over a KeysetPager, loaded page by page as it is scrolled.
+
+    Subclasses provide ``make_pager()`` and ``row_data(row)``, which turns a
+    pager row into the view's data dict.
+    """
+
+    pager = None
+
     def __init__(self, **kwargs):
-        super(AddressListView, self).__init__(**kwargs)
-        
-        self.bind(minimum_height=self.setter('height'))
-        self.fetch_data_from_database()
-        self.display()
-        
-    def fetch_data_from_database(self):
-        result = session.query(PrivateKeyList).order_by(PrivateKeyList.id.desc()).all()
-        self.data = [{'Address': item.__dict__['Address'],'PrivateKey': item.__dict__['PrivateKey']} for item in result]
-                
-        self.cols = 1
-        self.rows = len(self.data)
-        
+        super(PagedView, self).__init__(**kwargs)
+        Clock.schedule_once(lambda dt: self.update_list())
 
-    def display(self):
-        self.clear_widgets()
-        for item in self.data:
-            row = self.create_detail(item)
-            self.add_widget(row)
-            
+    def update_list(self):
+        """Adds rows recorded since the last update, or reloads the first page."""
+        if self.pager is None:
+            self.pager = self.make_pager()
+        incremental = self.pager.fetch_after is not None and len(self.pager) > 0
+        rows = [self.row_data(row) for row in self.pager.refresh()]
+        if incremental:
+            self.data[:0] = rows
+        else:
+            self.data = rows
+
+    def on_scroll_y(self, instance, scroll_y):
+        layout = self.layout_manager
+        if self.pager is None or layout is None or not self.data or layout.height <= 0:
+            return
+        # scroll_y is 1 at the top and 0 at the bottom of the list.
+        bottom = (1 - scroll_y) * max(layout.height - self.height, 0) + self.height
+        last_visible = int(len(self.data) * min(bottom / layout.height, 1))
+        rows = self.pager.ensure(last_visible)
+        if rows:
+            self.data.extend([self.row_data(row) for row in rows])
+
+
+class AddressRow(ButtonBehavior, BoxLayout):
+    address = StringProperty('')
+    utxos = StringProperty('')
+    balance = StringProperty('')
 
-    def create_detail(self, item):
-        btn = Button(text=item['Address'])
-        btn.background_color = [0,0,0,0]
-        btn.bind(on_press=lambda self: self.parent.switch_to_address(self.text))
-        return btn
+    def on_press(self):
+        self.parent.parent.switch_to_address(self.address)
+
+
+class AddressListView(PagedView):
+    """Every generated address with its UTXO count and balance, newest first."""
+    prefix = ''
+
+    def make_pager(self):
+        import wallet
+        return KeysetPager(lambda last_id, limit: wallet.address_page(last_id, limit, self.prefix))
+
+    @staticmethod
+    def row_data(row):
+        return {'address': row['Address'],
+                'utxos': '{} UTXOs'.format(row['utxos']),
+                'balance': '{} sats'.format(row['balance'])}
+
+    def search(self, prefix):
+        self.prefix = prefix.strip()
+        if self.pager is not None:
+            self.pager.reset()
+        self.update_list()
 
     def switch_to_address(self,address):
         app = App.get_running_app()
+        app.root.ids.main_sm.ids.Main_Screen.ids.sm.ids.QRAddress_Screen.address = address
         app.root.ids.main_sm.ids.Main_Screen.ids.sm.current = 'QRAddressScreen'
-        app.root.ids.main_sm.ids.Main_Screen.ids.sm.ids.QRAddress_Screen.ids.qr.data = address
-        app.root.ids.main_sm.ids.Main_Screen.ids.sm.ids.QRAddress_Screen.ids.recieve_address.text = address
-
-    def update_list(self):
-        self.clear_widgets()
-        self.bind(minimum_height=self.setter('height'))
-        self.fetch_data_from_database()
-        self.display()
 
 
 class PayScreen(Screen):
     def pay_to_address(self):
         address = self.ids.pay_address.text
         amount = self.ids.amount.text
-        result = session.query(UTXO).all()
-        utxosets = [item.__dict__.copy() for item in result]
-        print(utxosets)
-        recieve_key = session.query(PrivateKeyList).filter_by(is_activated=True).one()
-        output = create_transaction(utxosets,(address,int(amount)),recieve_key.Address)
-        result = broadcast_tx(output['rawtx'])
-        minerResponse = json.loads(result['data']['minerResponse']['payload'])
-        if minerResponse['returnResult']=="success" or (result['data']['error']['message'] in ['257: txn-already-known','Transaction already in the mempool']):
-            session.query(UTXO).delete()
-            if output['utxoset']:
-                output['utxoset']['PrivateKey'] = recieve_key.PrivateKey
-                session.bulk_insert_mappings(UTXO,[output['utxoset']])
-            output['is_recieved'] = False 
-            query = session.query(TxHistory).filter_by(txid=output['txid']).all()
-            if query:
-                pass
-            else:
-                session.bulk_insert_mappings(TxHistory,[output])
-            session.commit()
-        print(output)
-        print(result)
-
-        #print(output['utxoset'])
-        
+        return then(payment_executor.submit(self.pay, address, int(amount)), report)
 
     def pay_all_to_address(self):
         address = self.ids.pay_address.text
-        result = session.query(UTXO).all()
-        utxosets = [item.__dict__.copy() for item in result]
+        return then(payment_executor.submit(self.pay_all, address), report)
+
+    @staticmethod
+    def pay(address, amount):
+        import wallet
+        from transaction import create_transaction
+        with wallet.new_session() as db:
+            utxosets = wallet.get_spendable_utxos(db)
+            recieve_key = db.query(wallet.PrivateKeyList).filter_by(is_activated=True).one()
+            change_address, change_key = recieve_key.Address, recieve_key.PrivateKey
+        output = create_transaction(utxosets,(address,amount),change_address)
+        spent = set(output['spent'])
+        if output['utxoset']:
+            output['utxoset']['PrivateKey'] = change_key
+        output['is_recieved'] = False
+        addresses = {key_handle(item['PrivateKey']).address for item in utxosets if (item['txid'], item['txindex']) in spent}
+        wallet.get_db_writer().submit(wallet.record_payment, output, output['spent'], addresses | {change_address}).result()
+        wallet.get_broadcast_worker().wake()
+        return output
+
+    @staticmethod
+    def pay_all(address):
+        import wallet
+        from transaction import sweep
+        with wallet.new_session() as db:
+            utxosets = wallet.get_spendable_utxos(db)
         output = sweep(utxosets,address)
-        result = broadcast_tx(output['rawtx'])
-        minerResponse = json.loads(result['data']['minerResponse']['payload'])
-        if minerResponse['returnResult']=="success" or (result['data']['error']['message'] in ['257: txn-already-known','Transaction already in the mempool']):
-            output['is_recieved'] = False
-            session.query(UTXO).delete()
-            query = session.query(TxHistory).filter_by(txid=output['txid']).all()
-            if query:
-                pass
-            else:
-                session.bulk_insert_mappings(TxHistory,[output])
-            session.commit()
-        print(output)
-        print(result)
+        output['is_recieved'] = False
+        spent = [(item['txid'], item['txindex']) for item in utxosets]
+        wallet.get_db_writer().submit(wallet.record_payment, output, spent,
+                                      {key_handle(item['PrivateKey']).address for item in utxosets}).result()
+        wallet.get_broadcast_worker().wake()
+        return output
     
     def show_pay(self):
         pass
@@ -279,6 +280,22 @@ class RecieveScreen(Screen):
     pass
 
 class ScanScreen(Screen):
+    camera = None
+
+    def start_camera(self):
+        if self.camera is None:
+            # The camera and zbar are loaded on the first scan, not at startup.
+            from myzbarcam import MyZBarCam
+            self.camera = MyZBarCam()
+            self.camera.bind(symbols=lambda cam, symbols: setattr(
+                self.ids.qrcontent, 'text', ', '.join([str(symbol.data) for symbol in symbols])))
+            self.ids.camera_box.add_widget(self.camera, index=1)
+        self.camera.start()
+
+    def stop_camera(self):
+        if self.camera is not None:
+            self.camera.stop()
+
     def scan_fun(self,text):
         app = App.get_running_app()
         if app.root.ids.main_sm.ids.Main_Screen.ids.sm.current == 'RecieveScreen':
@@ -287,37 +304,31 @@ class ScanScreen(Screen):
             self.detect_address(text)
 
     def scantogetpaid(self,text):
-        #print(self.ids.qrcontent.text)
+        from transaction import decode_payment_request
         try:
-            qrcontent = ast.literal_eval(text[2:-1])
-            if all([(item in list(qrcontent.keys())) for item in ['version','input','output','lock_time']]):
-                print(qrcontent)
-                app = App.get_running_app()
-                app.root.ids.main_sm.current = 'MainScreen'
-                self.ids.zbarcam.stop()
-                result = session.query(PrivateKeyList).filter_by(is_activated=True).one()
-                prik = result.__dict__.copy()
-                address = prik['Address']
-                output = get_rawtx_to_pay(qrcontent,address)
-                result = broadcast_tx(output['rawtx'])
-                print(result)
-                minerResponse = json.loads(result['data']['minerResponse']['payload'])
-                if minerResponse['returnResult']=="success":
-                    output['is_recieved'] = True
-                    output['utxoset']['PrivateKey'] = prik['PrivateKey']
-                    session.bulk_insert_mappings(UTXO,[output['utxoset']])
-                    session.bulk_insert_mappings(TxHistory,[output])
-                    session.commit()
-                print(output)
-                
-                
-
-                #do transfer
-            else:
-                print('wrong format!')
-        except Exception as e:
+            qrcontent = decode_payment_request(text[2:-1])
+        except ValueError as e:
             print(e)
             print('wrong QR code')
+            return
+        app = App.get_running_app()
+        app.root.ids.main_sm.current = 'MainScreen'
+        self.stop_camera()
+        import wallet
+        result = wallet.session.query(wallet.PrivateKeyList).filter_by(is_activated=True).one()
+        prik = result.__dict__.copy()
+        then(io_executor.submit(self.get_paid, qrcontent, prik['Address'], prik['PrivateKey']), report)
+
+    @staticmethod
+    def get_paid(qrcontent, address, private_key):
+        import wallet
+        from transaction import get_rawtx_to_pay
+        output = get_rawtx_to_pay(qrcontent,address)
+        output['is_recieved'] = True
+        output['utxoset']['PrivateKey'] = private_key
+        wallet.get_db_writer().submit(wallet.record_payment, output, [], [address]).result()
+        wallet.get_broadcast_worker().wake()
+        return output
 
     def detect_address(self,text):
         try:
@@ -327,7 +338,7 @@ class ScanScreen(Screen):
             address = address_group.group()
             #self.ids.pay_address.text = address
             if address!='':
-                self.ids.zbarcam.stop()
+                self.stop_camera()
                 app = App.get_running_app()
                 app.root.ids.main_sm.ids.Main_Screen.ids.sm.ids.Pay_Screen.ids.pay_address.text  = address
                 app.root.ids.main_sm.current = 'MainScreen'
@@ -349,82 +360,40 @@ class RV(ScrollView):
         
 
 
-class HistoryView(GridLayout):
-    
-    def __init__(self, **kwargs):
-        super(HistoryView, self).__init__(**kwargs)
-        
-        self.bind(minimum_height=self.setter('height'))
-        self.fetch_data_from_database()
-        self.display()
-        
-    def fetch_data_from_database(self):
-        result = session.query(TxHistory).order_by(TxHistory.id.desc()).all()
-        if len(result)==0:
-            self.data = [
-                {'is_recieved': 'None', 'txid': 'None', 'amount': 'None'}
-            ]
-        else:
-            self.data = [{'is_recieved': item.__dict__['is_recieved'], 'txid': item.__dict__['txid'], 'amount': item.__dict__['amount']} for item in result]
-                
-        self.cols = 5
-        self.rows = 2*len(self.data)
-        
-
-    def display(self):
-        self.clear_widgets()
-        for item in self.data:
-            row = self.create_detail(item)
-            for col in row:
-                self.add_widget(col)
-            
-
-    def create_detail(self, item):
-        col = []
-        if item['is_recieved']==True:
-            first_column = Label(text='Recieved')
-        elif item['is_recieved']==False:
-            first_column = Label(text='Paid')
-        else:
-            first_column = Label(text=item['is_recieved'])
-        
-        second_column = Label(text=str(item['amount']))
-        
-        third_column = Button(text=item['txid'])
-        third_column.background_color = [0,0,0,0]
-        
-        third_column.fbind('on_press',lambda self: webbrowser.open('https://whatsonchain.com/tx/'+self.text))
-        col.append(Label(text=''))
-        col.append(first_column)
-        for i in range(1):
-            col.append(Label(text=''))
-        col.append(second_column)
-        col.append(Label(text=''))
-        for i in range(2):
-            col.append(Button(text='',background_color = [0,0,0,0],on_press=lambda self: webbrowser.open('https://whatsonchain.com/tx/'+item['txid'])))
-        col.append(third_column)
-        for i in range(2):
-            col.append(Button(text='',background_color = [0,0,0,0],on_press=lambda self: webbrowser.open('https://whatsonchain.com/tx/'+item['txid'])))
-        #print(len(col))
-        return col
-        #return [first_column, second_column, third_column,fourth_column]
+class HistoryRow(ButtonBehavior, BoxLayout):
+    kind = StringProperty('')
+    amount = StringProperty('')
+    txid = StringProperty('')
 
-    def update_list(self):
-        self.clear_widgets()
-        self.bind(minimum_height=self.setter('height'))
-        self.fetch_data_from_database()
-        self.display()
+    def on_press(self):
+        open_tx(self.txid)
 
 
+class HistoryView(PagedView):
+    """Transaction history, newest first."""
 
+    def make_pager(self):
+        import wallet
+        return KeysetPager(wallet.history_before, wallet.history_after)
 
-
-    
+    @staticmethod
+    def row_data(row):
+        return {'kind': 'Recieved' if row['is_recieved'] else 'Paid',
+                'amount': str(row['amount']),
+                'txid': row['txid']}
 
 
 class app1(App):
     def build(self):
         pass
+
+    def on_start(self):
+        # Resume pending broadcasts once the UI is up.
+        Clock.schedule_once(lambda dt: resume_broadcasts(), BROADCAST_START_DELAY)
+
+    def on_stop(self):
+        if 'wallet' in sys.modules:
+            sys.modules['wallet'].close()
     
 
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Versioned schema migrations for the wallet database.
+
+The applied version lives in SQLite's ``PRAGMA user_version``. Every step
+runs in its own transaction together with the version bump and is written
+to be idempotent, so wallets upgraded by the ad hoc code that predates this
+module (user_version 0 with some tables already present) migrate cleanly.
+"""
+from bsv_mini import key_handle
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.exec_driver_sql('PRAGMA table_info({})'.format(table))]
+
+
+def create_base_tables(conn):
+    # The schema the first release created.
+    conn.exec_driver_sql('''CREATE TABLE IF NOT EXISTS utxo (
+        id INTEGER NOT NULL,
+        "PrivateKey" VARCHAR,
+        txid VARCHAR,
+        txindex INTEGER,
+        confirmations INTEGER,
+        amount INTEGER,
+        PRIMARY KEY (id),
+        CONSTRAINT uix_1 UNIQUE (txid, txindex))''')
+    conn.exec_driver_sql('''CREATE TABLE IF NOT EXISTS privatekey (
+        id INTEGER NOT NULL,
+        "PrivateKey" VARCHAR,
+        "Address" VARCHAR,
+        is_activated BOOLEAN,
+        PRIMARY KEY (id))''')
+    conn.exec_driver_sql('''CREATE TABLE IF NOT EXISTS txhistory (
+        id INTEGER NOT NULL,
+        txid VARCHAR,
+        amount INTEGER,
+        rawtx VARCHAR,
+        is_recieved BOOLEAN,
+        PRIMARY KEY (id))''')
+
+
+def add_public_keys(conn):
+    # Stored public key and hash160 so signing does not derive them again.
+    columns = _columns(conn, 'privatekey')
+    for name in ('PublicKey', 'PublicKeyHash'):
+        if name not in columns:
+            conn.exec_driver_sql('ALTER TABLE privatekey ADD COLUMN "{}" VARCHAR'.format(name))
+    rows = conn.exec_driver_sql('SELECT id, "PrivateKey" FROM privatekey '
+                                'WHERE "PublicKey" IS NULL OR "PublicKeyHash" IS NULL').all()
+    for row_id, wif in rows:
+        key = key_handle(wif)
+        conn.exec_driver_sql('UPDATE privatekey SET "PublicKey" = ?, "PublicKeyHash" = ? WHERE id = ?',
+                             (key.public_key.hex(), key.hash160.hex(), row_id))
+
+
+def create_sync_tables(conn):
+    conn.exec_driver_sql('''CREATE TABLE IF NOT EXISTS addresssync (
+        id INTEGER NOT NULL,
+        "Address" VARCHAR,
+        utxo_hash VARCHAR,
+        last_sync FLOAT,
+        last_change FLOAT,
+        is_dirty BOOLEAN,
+        PRIMARY KEY (id),
+        UNIQUE ("Address"))''')
+    conn.exec_driver_sql('''CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER NOT NULL,
+        txid VARCHAR,
+        rawtx VARCHAR,
+        "Addresses" VARCHAR,
+        status VARCHAR,
+        attempts INTEGER,
+        next_attempt FLOAT,
+        last_error VARCHAR,
+        PRIMARY KEY (id),
+        UNIQUE (txid))''')
+
+
+BALANCE_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS utxo_balance_insert AFTER INSERT ON utxo BEGIN
+        UPDATE walletbalance SET amount = amount + IFNULL(NEW.amount, 0), count = count + 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS utxo_balance_delete AFTER DELETE ON utxo BEGIN
+        UPDATE walletbalance SET amount = amount - IFNULL(OLD.amount, 0), count = count - 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS utxo_balance_update AFTER UPDATE OF amount ON utxo BEGIN
+        UPDATE walletbalance SET amount = amount - IFNULL(OLD.amount, 0) + IFNULL(NEW.amount, 0) WHERE id = 1;
+    END''',
+)
+
+
+def create_balance(conn):
+    # Single row (id 1) kept equal to SUM(utxo.amount) by the triggers, seeded in the same transaction.
+    conn.exec_driver_sql('''CREATE TABLE IF NOT EXISTS walletbalance (
+        id INTEGER NOT NULL,
+        amount INTEGER,
+        count INTEGER,
+        PRIMARY KEY (id))''')
+    for trigger in BALANCE_TRIGGERS:
+        conn.exec_driver_sql(trigger)
+    conn.exec_driver_sql('INSERT OR IGNORE INTO walletbalance (id, amount, count) '
+                         'SELECT 1, IFNULL(SUM(amount), 0), COUNT(*) FROM utxo')
+
+
+def unique_history_txid(conn):
+    # One history row per transaction; older wallets kept one per received output.
+    conn.exec_driver_sql('UPDATE txhistory SET amount = (SELECT SUM(amount) FROM txhistory t WHERE t.txid = txhistory.txid) '
+                         'WHERE id IN (SELECT MIN(id) FROM txhistory WHERE txid IS NOT NULL GROUP BY txid HAVING COUNT(*) > 1)')
+    conn.exec_driver_sql('DELETE FROM txhistory WHERE txid IS NOT NULL AND id NOT IN '
+                         '(SELECT MIN(id) FROM txhistory WHERE txid IS NOT NULL GROUP BY txid)')
+    conn.exec_driver_sql('CREATE UNIQUE INDEX IF NOT EXISTS uix_txhistory_txid ON txhistory (txid)')
+
+
+def create_lookup_indexes(conn):
+    # UTXOs of one key (resync diff, spendable join) and key lookups by WIF and address.
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_utxo_privatekey ON utxo ("PrivateKey")')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_privatekey_privatekey ON privatekey ("PrivateKey")')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_privatekey_address ON privatekey ("Address")')
+    # Only one key is active at a time, so this index holds a single row.
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_privatekey_active ON privatekey (is_activated) WHERE is_activated = 1')
+    conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_outbox_due ON outbox (status, next_attempt)')
+
+
+MIGRATIONS = (
+    (1, create_base_tables),
+    (2, add_public_keys),
+    (3, create_sync_tables),
+    (4, create_balance),
+    (5, unique_history_txid),
+    (6, create_lookup_indexes),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def migrate(engine, migrations=MIGRATIONS, target=None):
+    """Applies every step newer than the database's user_version, up to ``target``; returns the final version."""
+    target = migrations[-1][0] if target is None else target
+    with engine.connect() as conn:
+        version = get_version(conn)
+    for step_version, step in migrations:
+        if step_version <= version or step_version > target:
+            continue
+        with engine.begin() as conn:
+            # pysqlite only opens transactions for DML; DDL steps need an explicit one to be atomic.
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            step(conn)
+            conn.exec_driver_sql('PRAGMA user_version = {:d}'.format(step_version))
+        version = step_version
+    return version
@@ -18,4 +18,39 @@ def fix_android_image(pil_image):
         return pil_image
     pil_image = pil_image.rotate(90)
     pil_image = ImageOps.mirror(pil_image)
-    return pil_image
\ No newline at end of file
+    return pil_image
+
+def luminance(pixels, size, roi=1.0, step=1, transpose=False):
+    """
+    8-bit grayscale frame from an RGBA texture buffer, as (data, width, height).
+
+    The green channel stands in for luminance. It is read with strided
+    slices of the buffer, so the RGBA frame itself is never copied or
+    converted; only the grayscale output is allocated. `roi` keeps that
+    fraction of the width and height around the centre and `step` keeps
+    every step-th pixel in both directions. `transpose` swaps rows and
+    columns, which undoes the mirroring of Android textures like
+    `fix_android_image` does (zbar does not read mirrored codes, but any
+    rotation is fine).
+    """
+    width, height = size
+    roi_width = int(width * roi) // step * step
+    roi_height = int(height * roi) // step * step
+    left = (width - roi_width) // 2
+    top = (height - roi_height) // 2
+    out_width = roi_width // step
+    out_height = roi_height // step
+    if transpose:
+        # Each output row is one column of the region, read with a single strided slice.
+        first = (top * width + left) * 4 + 1
+        end = (top + roi_height) * width * 4
+        stride = width * 4 * step
+        return b''.join([pixels[first + x * 4 * step:end:stride] for x in range(out_width)]), out_height, out_width
+    if roi_width == width and step == 1:
+        # Whole rows: a single slice over the region.
+        return pixels[top * width * 4 + 1:(top + roi_height) * width * 4:4], width, roi_height
+    out = bytearray(out_width * out_height)
+    for row, y in enumerate(range(top, top + roi_height, step)):
+        start = (y * width + left) * 4 + 1
+        out[row * out_width:(row + 1) * out_width] = pixels[start:start + roi_width * 4:4 * step]
+    return bytes(out), out_width, out_height
@@ -1,14 +1,16 @@
 import os
 from collections import namedtuple
+from functools import partial
 
 import PIL
 from kivy.clock import Clock
 from kivy.lang import Builder
-from kivy.properties import ListProperty
+from kivy.properties import BooleanProperty, ListProperty, NumericProperty, StringProperty
 from kivy.uix.anchorlayout import AnchorLayout
 from pyzbar import pyzbar
 
-from mycamutils import fix_android_image
+from framedecoder import FrameDecoder
+from mycamutils import fix_android_image, is_android, luminance
 
 
 Builder.load_file("zbarcam.kv")
@@ -22,14 +24,25 @@ class MyZBarCam(AnchorLayout):
 
     symbols = ListProperty([])
     Symbol = namedtuple('Symbol', ['type', 'data'])
-    # checking all possible types by default
-    code_types = ListProperty(set(pyzbar.ZBarSymbol))
+    # QR codes only by default, every extra symbology is another pass over the frame
+    code_types = ListProperty([pyzbar.ZBarSymbol.QRCODE])
+    # Fast path: zbar gets the grayscale centre `roi` of the frame, every
+    # `decode_step`-th pixel; on Android it is transposed while it is read
+    # instead of rotated and mirrored as separate RGBA copies.
+    fast_decode = BooleanProperty(True)
+    roi = NumericProperty(1.0)
+    decode_step = NumericProperty(1)
+    # While set, decoded frames are also saved here as raw RGBA
+    # (frame_<n>_<width>x<height>.rgba) for bench/bench_qr_decode.py.
+    record_dir = StringProperty('')
 
     def __init__(self, **kwargs):
         # lazy loading the kv file rather than loading at module level,
         # that way the `XCamera` import doesn't happen too early
         
         super().__init__(**kwargs)
+        self.decoder = None
+        self.recorded = 0
         Clock.schedule_once(lambda dt: self._setup())
 
     def _setup(self):
@@ -60,13 +73,33 @@ class MyZBarCam(AnchorLayout):
         xcamera.remove_widget(shoot_button)
 
     def _on_texture(self, instance):
-        self.symbols = self._detect_qrcode_frame(
-            texture=instance.texture, code_types=self.code_types)
+        # Decoding runs on self.decoder; the UI thread only copies the pixels
+        # of the frames the decoder is ready for.
+        decoder = self.decoder
+        if decoder is None or not decoder.wants_frame():
+            return
+        texture = instance.texture
+        pixels = texture.pixels
+        if self.record_dir:
+            self._record_frame(pixels, texture.size)
+        decoder.submit((pixels, texture.size))
+
+    def _record_frame(self, pixels, size):
+        name = 'frame_{:04d}_{}x{}.rgba'.format(self.recorded, *size)
+        with open(os.path.join(self.record_dir, name), 'wb') as f:
+            f.write(pixels)
+        self.recorded += 1
+
+    def _on_symbols(self, symbols):
+        # Called on the decoder thread; properties are only set on the UI thread.
+        Clock.schedule_once(lambda dt: setattr(self, 'symbols', symbols))
 
     @classmethod
     def _detect_qrcode_frame(cls, texture, code_types):
-        image_data = texture.pixels
-        size = texture.size
+        return cls._decode_pixels(texture.pixels, texture.size, code_types)
+
+    @classmethod
+    def _decode_pixels(cls, image_data, size, code_types):
         # Fix for mode mismatch between texture.colorfmt and data returned by
         # texture.pixels. texture.pixels always returns RGBA, so that should
         # be passed to PIL no matter what texture.colorfmt returns. refs:
@@ -74,8 +107,16 @@ class MyZBarCam(AnchorLayout):
         pil_image = PIL.Image.frombytes(mode='RGBA', size=size,
                                         data=image_data)
         pil_image = fix_android_image(pil_image)
+        return cls._symbols(pyzbar.decode(pil_image, symbols=code_types))
+
+    @classmethod
+    def _decode_fast(cls, image_data, size, code_types, roi=1.0, step=1, transpose=False):
+        # zbar reads QR codes in any rotation but not mirrored, so Android frames are transposed.
+        return cls._symbols(pyzbar.decode(luminance(image_data, size, roi, step, transpose), symbols=code_types))
+
+    @classmethod
+    def _symbols(cls, codes):
         symbols = []
-        codes = pyzbar.decode(pil_image, symbols=code_types)
         for code in codes:
             symbol = MyZBarCam.Symbol(type=code.type, data=code.data)
             symbols.append(symbol)
@@ -86,7 +127,18 @@ class MyZBarCam(AnchorLayout):
         return self.ids['xcamera']
 
     def start(self):
+        if self.decoder is None:
+            if self.fast_decode:
+                decode = partial(self._decode_fast, code_types=list(self.code_types),
+                                 roi=self.roi, step=int(self.decode_step), transpose=is_android())
+            else:
+                decode = partial(self._decode_pixels, code_types=list(self.code_types))
+            self.decoder = FrameDecoder(lambda frame: decode(*frame), self._on_symbols)
+            self.decoder.start()
         self.xcamera.play = True
 
     def stop(self):
-        self.xcamera.play = False
\ No newline at end of file
+        self.xcamera.play = False
+        if self.decoder is not None:
+            self.decoder.stop()
+            self.decoder = None
@@ -1,37 +1,305 @@
-from urllib.request import urlopen
-from urllib.request import Request
+import asyncio
+import http.client
 import json
-import certifi
 import os
+import ssl
+import threading
+import weakref
+from collections import deque
+from urllib.parse import urlsplit
 
-os.environ['SSL_CERT_FILE'] = certifi.where()
+from exceptions import HTTPError
 
-def post_data(url,obj):
-    method = "POST"
-    headers = {"Content-Type" : "application/json"}
+WOC_API = 'https://api.whatsonchain.com/v1/bsv/main'
+BROADCAST_URL = 'https://api.metasv.com/v1/merchants/tx/broadcast'
+#BROADCAST_URL = 'https://api.whatsonchain.com/v1/bsv/main/mapi/ab398390/tx'
+FEE_QUOTE_URL = 'https://merchantapi.taal.com/mapi/feeQuote'
+# mAPI multi-transaction submit (e.g. 'https://merchantapi.taal.com/mapi/txs'); None submits one by one.
+MAPI_TXS_URL = None
 
-    json_data = json.dumps(obj).encode("utf-8")
+BULK_UNSPENT_MAX = 20  # addresses per WhatsOnChain bulk unspent request
+BULK_TX_MAX = 20  # txids per WhatsOnChain bulk raw transaction request
 
-    request = Request(url, data=json_data, method=method, headers=headers)
-    with urlopen(request) as response:
-        response_body = json.loads(response.read())
-    return response_body
+DEFAULT_TIMEOUT = 15  # seconds, connect and each read
+POOL_SIZE = 4  # idle keep-alive connections kept per host
+# Methods resent by default when a reused keep-alive connection turns out to be dropped.
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+_ssl_context = None
+
+
+def get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        # certifi and the CA bundle are only loaded once the first HTTPS request is made.
+        import certifi
+        os.environ['SSL_CERT_FILE'] = certifi.where()
+        _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return _ssl_context
+
+
+def _split(url):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return (parts.scheme, parts.hostname, port), path
+
+
+def _encode(obj):
+    if obj is None:
+        return None, {}
+    return json.dumps(obj).encode('utf-8'), {'Content-Type': 'application/json'}
+
+
+def _decode(status, body, url):
+    if status >= 400:
+        raise HTTPError(status, body, url)
+    return json.loads(body)
+
+
+class HTTPClient:
+    """Thread-safe blocking client keeping up to ``pool_size`` keep-alive connections per host."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, pool_size=POOL_SIZE):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=get_ssl_context())
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _checkout(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool:
+                return pool.pop(), True
+        return self._connect(key), False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            pool = self._pools.setdefault(key, deque())
+            if len(pool) < self.pool_size:
+                pool.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, obj=None, resend=None):
+        """Sends the request and returns the decoded JSON response.
+
+        When a reused connection turns out to have been dropped, the request
+        is sent once more on a fresh one if ``resend`` is true (by default
+        only for IDEMPOTENT_METHODS): the server may have acted on it already.
+        """
+        if resend is None:
+            resend = method in IDEMPOTENT_METHODS
+        key, path = _split(url)
+        body, headers = _encode(obj)
+        while True:
+            conn, reused = self._checkout(key)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # The server dropped an idle keep-alive connection; retry once on a fresh one.
+                if reused and resend:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return _decode(response.status, data, url)
+
+    def get(self, url):
+        return self.request('GET', url)
+
+    def post(self, url, obj, resend=False):
+        return self.request('POST', url, obj, resend)
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for conn in pool:
+                conn.close()
+
+
+class AsyncHTTPClient:
+    """asyncio HTTP/1.1 client with per-host keep-alive pools.
+
+    Pools are tied to the event loop that created the connections, so use one
+    instance per loop.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, pool_size=POOL_SIZE):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._pools = {}
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        ssl_context = get_ssl_context() if scheme == 'https' else None
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=host if ssl_context else None),
+            self.timeout)
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed before response')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            headers['connection'] = 'close'
+        return status, headers, body
+
+    async def request(self, method, url, obj=None, resend=None):
+        """Sends the request and returns the decoded JSON response; ``resend`` as in HTTPClient.request."""
+        if resend is None:
+            resend = method in IDEMPOTENT_METHODS
+        key, path = _split(url)
+        body, headers = _encode(obj)
+        head = '{} {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\nAccept: application/json\r\n'.format(
+            method, path, key[1])
+        for name, value in headers.items():
+            head += '{}: {}\r\n'.format(name, value)
+        if body is not None:
+            head += 'Content-Length: {}\r\n'.format(len(body))
+        request = head.encode('latin-1') + b'\r\n' + (body or b'')
+
+        while True:
+            pool = self._pools.get(key)
+            reused = bool(pool)
+            reader, writer = pool.pop() if reused else await self._connect(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, response_headers, data = await asyncio.wait_for(self._read_response(reader), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # The server dropped an idle keep-alive connection; retry once on a fresh one.
+                if reused and resend:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            pool = self._pools.setdefault(key, [])
+            if response_headers.get('connection', '').lower() == 'close' or len(pool) >= self.pool_size:
+                writer.close()
+            else:
+                pool.append((reader, writer))
+            return _decode(status, data, url)
+
+    async def get(self, url):
+        return await self.request('GET', url)
+
+    async def post(self, url, obj, resend=False):
+        return await self.request('POST', url, obj, resend)
+
+    async def close(self):
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for _, writer in pool:
+                writer.close()
+
+
+client = HTTPClient()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """The AsyncHTTPClient shared by coroutines on the running event loop."""
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        async_client = _async_clients[loop] = AsyncHTTPClient()
+    return async_client
+
+
+def post_data(url,obj,resend=False):
+    return client.post(url, obj, resend)
 
 def get_data(url):
-    with urlopen(url) as response:
-        result = json.loads(response.read())
-    return result
+    return client.get(url)
 
 def get_tx_by_txid(txid):
-    result = get_data('https://api.whatsonchain.com/v1/bsv/main/tx/hash/' + txid)
+    result = get_data(WOC_API + '/tx/hash/' + txid)
     return result
 
+# Broadcasts are safe to resend: a miner that already has the transaction
+# answers "already known", which broadcast.classify counts as sent.
+
 def broadcast_tx(rawtx):
-    #result = post_data('https://api.whatsonchain.com/v1/bsv/main/mapi/ab398390/tx',{"rawtx":rawtx})
-    result = post_data('https://api.metasv.com/v1/merchants/tx/broadcast',{'rawHex':rawtx})
+    result = post_data(BROADCAST_URL,{'rawHex':rawtx},resend=True)
+    return result
+
+def broadcast_txs(rawtxs):
+    result = post_data(MAPI_TXS_URL,[{'rawtx':rawtx} for rawtx in rawtxs],resend=True)
+    return result
+
+def get_fee_quote():
+    result = get_data(FEE_QUOTE_URL)
     return result
 
 def get_utxo_by_address(address):
-    result = get_data('https://api.whatsonchain.com/v1/bsv/main/address/'+address+'/unspent')
+    result = get_data(WOC_API + '/address/'+address+'/unspent')
     return result
 
+def get_utxo_by_addresses(addresses):
+    # Bulk endpoint, at most BULK_UNSPENT_MAX addresses per call. A lookup, so safe to resend.
+    result = post_data(WOC_API + '/addresses/unspent',{'addresses':addresses},resend=True)
+    return result
+
+def get_raw_txs(txids):
+    # Bulk endpoint, at most BULK_TX_MAX txids per call. A lookup, so safe to resend.
+    result = post_data(WOC_API + '/txs/hex',{'txids':txids},resend=True)
+    return result
+
+
+async def get_tx_by_txid_async(txid, async_client=None):
+    return await (async_client or get_async_client()).get(WOC_API + '/tx/hash/' + txid)
+
+async def broadcast_tx_async(rawtx, async_client=None):
+    return await (async_client or get_async_client()).post(BROADCAST_URL, {'rawHex': rawtx}, resend=True)
+
+async def get_utxo_by_address_async(address, async_client=None):
+    return await (async_client or get_async_client()).get(WOC_API + '/address/' + address + '/unspent')
+
+async def get_utxo_by_addresses_async(addresses, async_client=None):
+    return await (async_client or get_async_client()).post(WOC_API + '/addresses/unspent', {'addresses': addresses}, resend=True)
+
+async def get_raw_txs_async(txids, async_client=None):
+    return await (async_client or get_async_client()).post(WOC_API + '/txs/hex', {'txids': txids}, resend=True)
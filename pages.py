@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Keyset-paginated row sources for the list screens.
+
+Nothing here touches Kivy: a pager only holds plain row dicts, so it can be
+driven and tested without a display. The views turn rows into widget data.
+"""
+
+PAGE_SIZE = 50  # rows per query
+PREFETCH = 50  # rows kept loaded beyond the last visible one
+
+
+class KeysetPager:
+    """Newest-first rows loaded a page at a time with ``id < last_id`` queries.
+
+    ``fetch_before(last_id, limit)`` returns up to ``limit`` row dicts with
+    an ``'id'`` key, newest first, older than ``last_id`` (the newest rows
+    when it is None). ``fetch_after(first_id)`` returns every row newer
+    than ``first_id``, newest first; without it ``refresh`` reloads.
+    """
+    __slots__ = ('fetch_before', 'fetch_after', 'page_size', 'rows', 'exhausted')
+
+    def __init__(self, fetch_before, fetch_after=None, page_size=PAGE_SIZE):
+        self.fetch_before = fetch_before
+        self.fetch_after = fetch_after
+        self.page_size = page_size
+        self.rows = []
+        self.exhausted = False
+
+    def __len__(self):
+        return len(self.rows)
+
+    def reset(self):
+        self.rows = []
+        self.exhausted = False
+
+    def load_more(self):
+        """Appends the next older page; returns the rows added."""
+        if self.exhausted:
+            return []
+        last_id = self.rows[-1]['id'] if self.rows else None
+        page = list(self.fetch_before(last_id, self.page_size))
+        if len(page) < self.page_size:
+            self.exhausted = True
+        self.rows.extend(page)
+        return page
+
+    def ensure(self, index, prefetch=PREFETCH):
+        """Loads pages until row ``index`` plus ``prefetch`` rows are present (or none are left)."""
+        added = []
+        while not self.exhausted and len(self.rows) <= index + prefetch:
+            added.extend(self.load_more())
+        return added
+
+    def refresh(self):
+        """Prepends rows added since the newest loaded one; returns them.
+
+        Without ``fetch_after``, or before anything is loaded, the first page
+        is reloaded instead and every loaded row is returned.
+        """
+        if self.fetch_after is None or not self.rows:
+            self.reset()
+            return self.load_more()
+        new_rows = list(self.fetch_after(self.rows[0]['id']))
+        self.rows[:0] = new_rows
+        return new_rows
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import hmac
+from hashlib import sha256 as _sha256
+
+
+# secp256k1 domain parameters (y^2 = x^3 + 7 over F_p).
+P = 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f
+N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+GX = 0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
+GY = 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+
+HALF_N = N // 2
+
+# Bits per comb window: 32 windows of 255 affine points each.
+WINDOW = 8
+
+
+def _affine_add(p1, p2):
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+    x1, y1 = p1
+    x2, y2 = p2
+    if x1 == x2:
+        if (y1 + y2) % P == 0:
+            return None
+        lam = 3 * x1 * x1 * pow(2 * y1, -1, P) % P
+    else:
+        lam = (y2 - y1) * pow(x2 - x1, -1, P) % P
+    x3 = (lam * lam - x1 - x2) % P
+    return x3, (lam * (x1 - x3) - y1) % P
+
+
+def _jacobian_add_affine(jp, x2, y2):
+    """Mixed Jacobian + affine addition (a = 0); None is the point at infinity."""
+    if jp is None:
+        return x2, y2, 1
+    X, Y, Z = jp
+    ZZ = Z * Z % P
+    H = (x2 * ZZ - X) % P
+    R = (y2 * ZZ % P * Z - Y) % P
+    if H == 0:
+        if R == 0:
+            return _affine_add((x2, y2), (x2, y2)) + (1,)
+        return None
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X * HH % P
+    X3 = (R * R - HHH - 2 * V) % P
+    return X3, (R * (V - X3) - Y * HHH) % P, Z * H % P
+
+
+def _to_affine(jp):
+    if jp is None:
+        return None
+    X, Y, Z = jp
+    zinv = pow(Z, -1, P)
+    zinv2 = zinv * zinv % P
+    return X * zinv2 % P, Y * zinv2 * zinv % P
+
+
+def _batch_to_affine(points):
+    """Normalizes finite Jacobian points with a single field inversion."""
+    prefix = [1]
+    for _, _, Z in points:
+        prefix.append(prefix[-1] * Z % P)
+    inv = pow(prefix[-1], -1, P)
+    affine = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        X, Y, Z = points[i]
+        zinv = inv * prefix[i] % P
+        inv = inv * Z % P
+        zinv2 = zinv * zinv % P
+        affine[i] = (X * zinv2 % P, Y * zinv2 * zinv % P)
+    return affine
+
+
+class GeneratorTable:
+    """Fixed-base comb table for G, built once and shared by every signature.
+
+    Row ``i`` holds ``j * 2^(window*i) * G`` at index ``j`` (``1 .. 2^window-1``),
+    so ``k*G`` costs one mixed addition per non-zero window and no doublings.
+    """
+    __slots__ = ('window', 'rows')
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.rows = []
+        base = (GX, GY)
+        for _ in range((256 + window - 1) // window):
+            multiples = [(base[0], base[1], 1)]
+            for _ in range((1 << window) - 2):
+                multiples.append(_jacobian_add_affine(multiples[-1], *base))
+            row = [None] + _batch_to_affine(multiples)
+            self.rows.append(row)
+            base = _affine_add(row[-1], base)
+
+    def multiply(self, k):
+        """Returns the affine point ``k*G``, or None for the point at infinity."""
+        window = self.window
+        mask = (1 << window) - 1
+        jp = None
+        for row in self.rows:
+            digit = k & mask
+            k >>= window
+            if digit:
+                jp = _jacobian_add_affine(jp, *row[digit])
+        return _to_affine(jp)
+
+
+_generator_table = None
+
+
+def get_generator_table():
+    global _generator_table
+    if _generator_table is None:
+        _generator_table = GeneratorTable()
+    return _generator_table
+
+
+def public_key_point(secexp):
+    return get_generator_table().multiply(secexp)
+
+
+def public_key_compressed(secexp):
+    x, y = public_key_point(secexp)
+    return (b'\x03' if y & 1 else b'\x02') + x.to_bytes(32, 'big')
+
+
+def rfc6979_nonces(secexp, digest):
+    """Yields the RFC 6979 (HMAC-SHA256) nonce sequence for ``digest``."""
+    z = int.from_bytes(digest, 'big')
+    if z >= N:
+        z -= N
+    bx = secexp.to_bytes(32, 'big') + z.to_bytes(32, 'big')
+    v = b'\x01' * 32
+    k = b'\x00' * 32
+    k = hmac.new(k, v + b'\x00' + bx, _sha256).digest()
+    v = hmac.new(k, v, _sha256).digest()
+    k = hmac.new(k, v + b'\x01' + bx, _sha256).digest()
+    v = hmac.new(k, v, _sha256).digest()
+    while True:
+        v = hmac.new(k, v, _sha256).digest()
+        candidate = int.from_bytes(v, 'big')
+        if 1 <= candidate < N:
+            yield candidate
+        k = hmac.new(k, v + b'\x00', _sha256).digest()
+        v = hmac.new(k, v, _sha256).digest()
+
+
+def sign_digest(secexp, digest):
+    """Deterministic low-s ECDSA over a 32-byte digest, returns (r, s)."""
+    table = get_generator_table()
+    z = int.from_bytes(digest, 'big')
+    for k in rfc6979_nonces(secexp, digest):
+        r = table.multiply(k)[0] % N
+        if r == 0:
+            continue
+        s = pow(k, -1, N) * (z + secexp * r % N) % N
+        if s == 0:
+            continue
+        if s > HALF_N:
+            s = N - s
+        return r, s
+
+
+def _der_integer(num):
+    encoded = num.to_bytes((num.bit_length() + 8) // 8, 'big')
+    return b'\x02' + len(encoded).to_bytes(1, 'big') + encoded
+
+
+def der_encode(r, s):
+    body = _der_integer(r) + _der_integer(s)
+    return b'\x30' + len(body).to_bytes(1, 'big') + body
+
+
+def sign(secexp, msg):
+    """Same output as python-ecdsa ``sign_deterministic(msg, sha256, sigencode_der_canonize)``."""
+    return der_encode(*sign_digest(secexp, _sha256(msg).digest()))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import logging
+import time
+
+from exceptions import HTTPError
+from network import BULK_UNSPENT_MAX, get_async_client, get_utxo_by_address_async, get_utxo_by_addresses_async
+from transaction import convert_utxo_format
+
+# WhatsOnChain's free tier allows 3 requests per second.
+API_RATE_LIMIT = 3
+API_BURST = 3
+SYNC_CONCURRENCY = 4
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+BACKOFF_MAX = 8
+
+
+class TokenBucket:
+    """asyncio token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate=API_RATE_LIMIT, capacity=API_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def is_retryable(error):
+    if isinstance(error, HTTPError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (ConnectionError, asyncio.TimeoutError, OSError))
+
+
+async def call_with_retries(bucket, func, *args):
+    """Runs ``func(*args)`` under the rate limit, backing off on 429/5xx and connection errors."""
+    delay = BACKOFF_BASE
+    for attempt in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        try:
+            return await func(*args)
+        except Exception as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            logging.info('retrying {} after {}: {}'.format(func.__name__, delay, e))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+
+
+async def fetch_unspents_async(addresses, bucket=None, concurrency=SYNC_CONCURRENCY, bulk=True):
+    """Unspent outputs of every address, as {address: [utxo dict, ...]}.
+
+    Addresses go out in BULK_UNSPENT_MAX sized batches to the bulk endpoint
+    (or one by one with ``bulk=False``), ``concurrency`` requests at a time,
+    all sharing one token bucket.
+    """
+    bucket = bucket or TokenBucket()
+    semaphore = asyncio.Semaphore(concurrency)
+    result = {}
+
+    async def fetch_batch(batch):
+        async with semaphore:
+            if bulk:
+                try:
+                    entries = await call_with_retries(bucket, get_utxo_by_addresses_async, batch)
+                except HTTPError as e:
+                    if e.status != 404:
+                        raise
+                    entries = None  # no bulk endpoint on this server
+                if entries is not None:
+                    for entry in entries:
+                        if entry.get('error'):
+                            raise ValueError('unspent lookup for {} failed: {}'.format(entry['address'], entry['error']))
+                        result[entry['address']] = [convert_utxo_format(item) for item in entry['unspent']]
+                    return
+            for address in batch:
+                unspent = await call_with_retries(bucket, get_utxo_by_address_async, address)
+                result[address] = [convert_utxo_format(item) for item in unspent]
+
+    size = BULK_UNSPENT_MAX if bulk else 1
+    await asyncio.gather(*[fetch_batch(addresses[i:i + size]) for i in range(0, len(addresses), size)])
+    return result
+
+
+def fetch_unspents(addresses, **kwargs):
+    """Blocking wrapper around fetch_unspents_async on a private event loop."""
+    async def run():
+        try:
+            return await fetch_unspents_async(addresses, **kwargs)
+        finally:
+            await get_async_client().close()
+    return asyncio.run(run())
+
+
+# Incremental resync: an address is refetched only when it is the active
+# receive address, marked dirty, changed recently, or has not been checked
+# for STALE_AFTER seconds.
+RECENT_WINDOW = 24 * 3600
+STALE_AFTER = 7 * 24 * 3600
+
+
+def utxo_set_hash(utxosets):
+    """Order-independent digest of a UTXO set, compared against the stored cursor."""
+    outpoints = sorted('{}:{}:{}'.format(item['txid'], item['txindex'], item['amount']) for item in utxosets)
+    return hashlib.sha256('\n'.join(outpoints).encode()).hexdigest()
+
+
+def needs_sync(state, is_activated, now, recent_window=RECENT_WINDOW, stale_after=STALE_AFTER):
+    """Whether an address with sync ``state`` (None if never synced) is due for a refresh."""
+    if state is None or state.last_sync is None or is_activated or state.is_dirty:
+        return True
+    if state.last_change is not None and now - state.last_change < recent_window:
+        return True
+    return now - state.last_sync >= stale_after
+
+
+def diff_utxos(current, fetched):
+    """Splits ``fetched`` against stored rows into (utxos to insert, ids to delete).
+
+    ``current`` holds (id, txid, txindex) rows for one address.
+    """
+    stored = {(txid, txindex): row_id for row_id, txid, txindex in current}
+    inserts = []
+    for item in fetched:
+        if stored.pop((item['txid'], item['txindex']), None) is None:
+            inserts.append(item)
+    return inserts, list(stored.values())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcast import FAILED, RETRY, SENT, classify, parse_batch_response, parse_broadcast_response
+
+
+def miner_response(return_result, description):
+    payload = json.dumps({'returnResult': return_result, 'resultDescription': description})
+    return {'data': {'minerResponse': {'payload': payload}}}
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_accepted(self):
+        self.assertEqual(classify('success', ''), SENT)
+        self.assertEqual(classify('failure', 'ERROR: 257: txn-already-known'), SENT)
+
+    def test_permanent(self):
+        for description in ('ERROR: 16: bad-txns-inputs-missingorspent', 'Missing inputs',
+                            'ERROR: 258: txn-mempool-conflict', 'txn-double-spend-detected',
+                            'ERROR: 16: mandatory-script-verify-flag-failed (Signature must be zero for failed CHECK(MULTI)SIG operation)',
+                            'ERROR: 64: dust'):
+            self.assertEqual(classify('failure', description), FAILED, description)
+
+    def test_transient(self):
+        for description in ('Not enough fees', 'Service Unavailable', 'ERROR: mempool full', None):
+            self.assertEqual(classify('failure', description), RETRY, description)
+
+
+class ParseTest(unittest.TestCase):
+    def test_broadcast_response(self):
+        self.assertEqual(parse_broadcast_response(miner_response('success', ''))[0], SENT)
+        self.assertEqual(parse_broadcast_response(miner_response('failure', 'Missing inputs')),
+                         (FAILED, 'Missing inputs'))
+        self.assertEqual(parse_broadcast_response({'data': {'error': {'message': 'timeout'}}}), (RETRY, 'timeout'))
+
+    def test_batch_response(self):
+        payload = json.dumps({'txs': [
+            {'txid': 'a', 'returnResult': 'success', 'resultDescription': ''},
+            {'txid': 'b', 'returnResult': 'failure', 'resultDescription': 'ERROR: 258: txn-mempool-conflict'},
+            {'txid': 'c', 'returnResult': 'failure', 'resultDescription': 'Not enough fees'},
+        ]})
+        statuses = parse_batch_response({'payload': payload})
+        self.assertEqual({txid: status for txid, (status, _) in statuses.items()}, {'a': SENT, 'b': FAILED, 'c': RETRY})
+
+
+if __name__ == '__main__':
+    unittest.main()
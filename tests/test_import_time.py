@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Startup import budget for the wallet modules.
+
+Each module is imported in a fresh ``python -X importtime`` process and
+checked against a time budget and a list of modules it must not pull in
+at import time. Importing must also not create files next to the code
+(the wallet and transaction cache are opened on first use).
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules main needs before its first frame; without them its budget cannot be measured.
+UI_REQUIREMENTS = ('kivy',)
+
+
+def import_profile(module):
+    """{module name: cumulative microseconds} for everything ``module`` imports, startup (site) excluded."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name == 'site':
+            profile = {}  # everything before belongs to interpreter startup
+            continue
+        if cumulative.strip().isdigit():
+            profile[name] = int(cumulative)
+    return profile
+
+
+class ImportTimeTest(unittest.TestCase):
+    def assertImportBudget(self, module, budget, forbidden):
+        """Importing ``module`` takes at most ``budget`` ms, loads none of ``forbidden`` and creates no files."""
+        before = set(os.listdir(ROOT))
+        profile = import_profile(module)
+        created = sorted(set(os.listdir(ROOT)) - before - {'__pycache__'})
+        self.assertEqual(created, [], 'importing {} creates files'.format(module))
+        self.assertEqual([name for name in forbidden if name in profile], [],
+                         'importing {} loads modules it should defer'.format(module))
+        elapsed = profile.get(module, 0) / 1000
+        self.assertLessEqual(elapsed, budget, 'importing {} takes {:.1f} ms'.format(module, elapsed))
+
+    def test_bsv_mini(self):
+        self.assertImportBudget('bsv_mini', 60, ('ecdsa',))
+
+    def test_network(self):
+        self.assertImportBudget('network', 150, ('certifi', 'ecdsa'))
+
+    def test_transaction(self):
+        self.assertImportBudget('transaction', 200, ('certifi', 'ecdsa'))
+
+    def test_sync(self):
+        self.assertImportBudget('sync', 200, ('certifi', 'ecdsa'))
+
+    def test_broadcast(self):
+        self.assertImportBudget('broadcast', 200, ('certifi', 'ecdsa'))
+
+    def test_db(self):
+        self.assertImportBudget('db', 400, ('ecdsa',))  # mostly sqlalchemy itself
+
+    def test_migrations(self):
+        self.assertImportBudget('migrations', 60, ('ecdsa', 'sqlalchemy'))
+
+    def test_wallet(self):
+        self.assertImportBudget('wallet', 500, ('ecdsa', 'certifi'))  # about 430 ms, 280 of them sqlalchemy
+
+    def test_main(self):
+        missing = [name for name in UI_REQUIREMENTS if subprocess.run(
+            [sys.executable, '-c', 'import ' + name], capture_output=True).returncode]
+        if missing:
+            self.skipTest('main needs {}, which is not installed'.format(', '.join(missing)))
+        # About 330-380 ms, nearly all of it Kivy and its window; the wallet database is imported after
+        # the first frame. PIL is not listed: Kivy's image loader tries it whether or not the scanner is used.
+        self.assertImportBudget('main', 450, (
+            'sqlalchemy', 'wallet', 'db', 'migrations', 'ecdsa', 'certifi', 'transaction', 'broadcast', 'sync',
+            'txcache', 'myzbarcam', 'pyzbar', 'kivy.garden.qrcode', 'kivy_garden.xcamera', 'webbrowser'))
+
+
+if __name__ == '__main__':
+    unittest.main()
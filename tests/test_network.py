@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import http.server
+import json
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exceptions import HTTPError
+from network import AsyncHTTPClient, HTTPClient
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Just enough of an API server: JSON replies over HTTP/1.1 keep-alive connections."""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, obj, close=False):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Closed without a "Connection: close" header, as an idle timeout on the server looks to the client.
+        self.close_connection = close
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.path == '/json':
+            self.send_json(200, {'ok': True})
+        elif self.path == '/then-close':
+            self.send_json(200, {'ok': True}, close=True)
+        elif self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            body = json.dumps({'items': list(range(100))}).encode()
+            for start in range(0, len(body), 64):
+                chunk = body[start:start + 64]
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        obj = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(('POST', self.path))
+        self.send_json(200, {'echo': obj})
+
+
+class StandInServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.key = ('http', '127.0.0.1', self.server.server_address[1])
+
+    def idle(self, client):
+        return len(client._pools.get(self.key, ()))
+
+
+class HTTPClientTest(StandInServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = HTTPClient(timeout=5)
+        self.addCleanup(self.client.close)
+
+    def test_connection_reuse(self):
+        self.assertEqual(self.client.get(self.base + '/json'), {'ok': True})
+        self.assertEqual(self.idle(self.client), 1)
+        self.assertEqual(self.client.post(self.base + '/echo', [1, 2]), {'echo': [1, 2]})
+        self.assertEqual(self.idle(self.client), 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_chunked_body(self):
+        self.assertEqual(self.client.get(self.base + '/chunked'), {'items': list(range(100))})
+        self.assertEqual(self.idle(self.client), 1)
+
+    def test_client_error(self):
+        with self.assertRaises(HTTPError) as raised:
+            self.client.get(self.base + '/missing')
+        self.assertEqual(raised.exception.status, 404)
+        self.assertEqual(json.loads(raised.exception.body), {'error': 'not found'})
+
+    def test_stale_connection_is_resent(self):
+        self.client.get(self.base + '/then-close')
+        self.assertEqual(self.client.get(self.base + '/json'), {'ok': True})
+        self.assertEqual(self.server.connections, 2)
+        self.client.get(self.base + '/then-close')
+        self.assertEqual(self.client.post(self.base + '/echo', 1, resend=True), {'echo': 1})
+
+    def test_stale_connection_post_is_not_resent(self):
+        self.client.get(self.base + '/then-close')
+        with self.assertRaises(ConnectionError):
+            self.client.post(self.base + '/echo', 1)
+        self.assertNotIn(('POST', '/echo'), self.server.requests)
+
+
+class AsyncHTTPClientTest(StandInServerTestCase, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = AsyncHTTPClient(timeout=5)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_connection_reuse(self):
+        self.assertEqual(await self.client.get(self.base + '/json'), {'ok': True})
+        self.assertEqual(self.idle(self.client), 1)
+        self.assertEqual(await self.client.post(self.base + '/echo', [1, 2]), {'echo': [1, 2]})
+        self.assertEqual(self.idle(self.client), 1)
+        self.assertEqual(self.server.connections, 1)
+
+    async def test_chunked_body(self):
+        self.assertEqual(await self.client.get(self.base + '/chunked'), {'items': list(range(100))})
+        self.assertEqual(self.idle(self.client), 1)
+
+    async def test_client_error(self):
+        with self.assertRaises(HTTPError) as raised:
+            await self.client.get(self.base + '/missing')
+        self.assertEqual(raised.exception.status, 404)
+
+    async def test_stale_connection_is_resent(self):
+        await self.client.get(self.base + '/then-close')
+        self.assertEqual(await self.client.get(self.base + '/json'), {'ok': True})
+        self.assertEqual(self.server.connections, 2)
+        await self.client.get(self.base + '/then-close')
+        self.assertEqual(await self.client.post(self.base + '/echo', 1, resend=True), {'echo': 1})
+
+    async def test_stale_connection_post_is_not_resent(self):
+        await self.client.get(self.base + '/then-close')
+        with self.assertRaises(ConnectionError):
+            await self.client.post(self.base + '/echo', 1)
+        self.assertNotIn(('POST', '/echo'), self.server.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
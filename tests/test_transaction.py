@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bsv_mini import bsv
+from exceptions import InsufficientFunds
+from fees import DUST
+from transaction import generate_sighash_single_rawtx, get_rawtx_to_pay, sweep
+
+FEE_RATE = 1  # sat/byte
+
+
+class StaticTxCache:
+    """Parent output values for get_rawtx_to_pay without the network."""
+
+    def __init__(self, utxosets):
+        self.amounts = {(item['txid'], item['txindex']): item['amount'] for item in utxosets}
+
+    def output_amounts(self, outpoints):
+        return [self.amounts[outpoint] for outpoint in outpoints]
+
+
+class DustTest(unittest.TestCase):
+    def setUp(self):
+        self.key = bsv()
+        self.address = bsv().address
+
+    def utxos(self, *amounts):
+        return [{'PrivateKey': self.key.to_wif(), 'txid': '{:064x}'.format(i + 1), 'txindex': 0,
+                 'amount': amount, 'confirmations': 0} for i, amount in enumerate(amounts)]
+
+    def test_sweep(self):
+        output = sweep(self.utxos(6000, 4000), self.address, fee_rate=FEE_RATE)
+        self.assertGreater(output['amount'], DUST)
+        for amounts in ((100,), (300, 400), (600,)):
+            with self.assertRaises(InsufficientFunds, msg=amounts):
+                sweep(self.utxos(*amounts), self.address, fee_rate=FEE_RATE)
+
+    def test_get_rawtx_to_pay(self):
+        utxosets = self.utxos(50000)
+        cache = StaticTxCache(utxosets)
+        request = generate_sighash_single_rawtx(utxosets, self.key.address, 10000)
+        output = get_rawtx_to_pay(request, self.address, fee_rate=FEE_RATE, tx_cache=cache)
+        self.assertTrue(DUST < output['amount'] < 10000)
+        for authorized in (100, 300, 700):
+            request = generate_sighash_single_rawtx(utxosets, self.key.address, authorized)
+            with self.assertRaises(InsufficientFunds, msg=authorized):
+                get_rawtx_to_pay(request, self.address, fee_rate=FEE_RATE, tx_cache=cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
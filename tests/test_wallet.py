@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+import wallet
+from bsv_mini import bsv
+from broadcast import BROADCAST_MAX_ATTEMPTS, FAILED, RETRY
+from db import create_wallet_engine
+from migrations import migrate
+
+FUNDING = {'txid': 'aa' * 32, 'txindex': 0, 'amount': 100000, 'confirmations': 0}
+PAYMENT_TXID = 'bb' * 32
+
+
+class WalletTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        engine = create_wallet_engine(os.path.join(self.tmp.name, 'wallet.sqlite3'))
+        migrate(engine)
+        self.addCleanup(engine.dispose)
+        self.db = sessionmaker(bind=engine)()
+        self.addCleanup(self.db.close)
+        prik = bsv()
+        self.private_key, self.address = prik.to_wif(), prik.address
+        self.db.bulk_insert_mappings(wallet.PrivateKeyList, [wallet.new_key_row(prik)])
+        self.db.commit()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def resync(self, fetched, now):
+        result = wallet.apply_resync(self.db, [(self.private_key, self.address)], {self.address: fetched}, now)
+        self.db.commit()
+        return result
+
+    def pay(self, amount=60000, fee=200):
+        change = FUNDING['amount'] - amount - fee
+        output = {'txid': PAYMENT_TXID, 'rawtx': '00', 'amount': amount, 'is_recieved': False,
+                  'utxoset': {'PrivateKey': self.private_key, 'txid': PAYMENT_TXID, 'txindex': 1,
+                              'amount': change, 'confirmations': 0}}
+        wallet.record_payment(self.db, output, [(FUNDING['txid'], FUNDING['txindex'])], [self.address])
+        self.db.commit()
+
+    def fail_broadcast(self, now):
+        for _ in range(BROADCAST_MAX_ATTEMPTS):
+            wallet.OutboxStore._record(self.db, {PAYMENT_TXID: (RETRY, 'connection reset')}, now)
+        self.db.commit()
+
+
+class ResyncTest(WalletTestCase):
+    def test_funding(self):
+        self.assertEqual(self.resync([FUNDING], 1), (1, 0))
+        self.assertEqual(wallet.get_balance(self.db), 100000)
+        self.assertEqual(self.resync([FUNDING], 2), (0, 0))
+
+    def test_failed_broadcast_is_restored(self):
+        self.resync([FUNDING], 1)
+        self.pay()
+        self.assertEqual(wallet.get_balance(self.db), 39800)
+        self.fail_broadcast(2)
+        self.assertEqual(self.db.query(wallet.Outbox.status).scalar(), wallet.OUTBOX_FAILED)
+        self.assertEqual(wallet.get_balance(self.db), 0)
+        # The address's UTXO set never changed on chain, so only the dirty flag forces the diff.
+        self.assertEqual(self.resync([FUNDING], 3), (1, 0))
+        self.assertEqual(wallet.get_balance(self.db), 100000)
+        self.assertFalse(self.db.query(wallet.AddressSyncState.is_dirty).scalar())
+
+    def test_pending_broadcast_is_kept(self):
+        self.resync([FUNDING], 1)
+        # Paid while the fetch was in flight: the fetched set still has the funding output.
+        self.pay()
+        deposit = dict(FUNDING, txid='cc' * 32, amount=5000)
+        self.assertEqual(self.resync([FUNDING, deposit], 2), (0, 0))
+        self.assertEqual(wallet.get_balance(self.db), 39800)
+
+
+class OutboxTest(WalletTestCase):
+    def test_transient_error_is_retried(self):
+        self.resync([FUNDING], 1)
+        self.pay()
+        wallet.OutboxStore._record(self.db, {PAYMENT_TXID: (RETRY, 'connection reset')}, 2)
+        self.db.commit()
+        self.assertEqual(self.db.query(wallet.Outbox.status).scalar(), wallet.OUTBOX_PENDING)
+        self.assertEqual(wallet.get_balance(self.db), 39800)
+
+    def test_permanent_rejection_rolls_back_at_once(self):
+        self.resync([FUNDING], 1)
+        self.pay()
+        wallet.OutboxStore._record(self.db, {PAYMENT_TXID: (FAILED, 'Missing inputs')}, 2)
+        self.db.commit()
+        self.assertEqual(self.db.query(wallet.Outbox.status).scalar(), wallet.OUTBOX_FAILED)
+        self.assertEqual(self.resync([FUNDING], 3), (1, 0))
+        self.assertEqual(wallet.get_balance(self.db), 100000)
+
+
+class RecordPaymentTest(WalletTestCase):
+    def test_double_spend_is_rejected(self):
+        self.resync([FUNDING], 1)
+        self.pay()
+        output = {'txid': 'dd' * 32, 'rawtx': '00', 'amount': 1000, 'is_recieved': False, 'utxoset': None}
+        with self.assertRaises(ValueError):
+            wallet.record_payment(self.db, output, [(FUNDING['txid'], FUNDING['txindex'])], [self.address])
+        self.db.rollback()
+        self.assertEqual(self.db.query(wallet.Outbox.txid).all(), [(PAYMENT_TXID,)])
+        self.assertEqual(wallet.get_balance(self.db), 39800)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,22 +1,31 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import logging
+import re
 from collections import namedtuple
 
+from hashlib import sha256 as _sha256
+
 from crypto import double_sha256, sha256
 
 from crypto import address_to_public_key_hash
 
 from utils import (
-    bytes_to_hex,  hex_to_bytes, int_to_varint
+    base45_decode, base45_encode, bytes_to_hex,  hex_to_bytes, int_to_varint
 )
 
 import math
-from bsv_mini import bsv
+from concurrent.futures import ProcessPoolExecutor
+from bsv_mini import bsv, key_handle
 from meta import Unspent
+from coinselect import select_coins
+from exceptions import InsufficientFunds
+from fees import (
+    DUST, P2PKH_INPUT_SIZE, P2PKH_OUTPUT_SIZE, fee_for_size, fee_quotes, output_size, settle_fee, transaction_size
+)
 #import cryptos
 #from kivy.network.urlrequest import UrlRequest
-from network import get_tx_by_txid, get_utxo_by_address, broadcast_tx
+from network import get_utxo_by_address, broadcast_tx
 #from urllib.request import urlopen
 #from urllib.request import Request
 #import json
@@ -31,17 +40,15 @@ VERSION_1 = 0x01.to_bytes(4, byteorder='little')
 SEQUENCE = 0xffffffff.to_bytes(4, byteorder='little')
 LOCK_TIME = 0x00.to_bytes(4, byteorder='little')
 
-# The dust is described in bitcoin-sv/src/primitives/transaction.h
-DUST = 546
-
-##
-# Python 3 doesn't allow bitwise operators on byte objects...
-HASH_TYPE = 0x01.to_bytes(4, byteorder='little')
+SIGHASH_ALL = 0x01
+SIGHASH_NONE = 0x02
+SIGHASH_SINGLE = 0x03
+SIGHASH_ANYONECANPAY = 0x80
 # BitcoinSV fork ID.
-SIGHASH_FORKID = 0x40.to_bytes(4, byteorder='little')
-# So we just do this for now. FIXME
-HASH_TYPE = 0x41.to_bytes(4, byteorder='little')
-##
+SIGHASH_FORKID = 0x40
+HASH_TYPE = SIGHASH_ALL | SIGHASH_FORKID
+
+ZERO_HASH = b'\x00' * 32
 
 OP_0 = b'\x00'
 OP_FALSE = b'\00'
@@ -58,34 +65,199 @@ OP_PUSHDATA4 = b'\x4e'
 
 MESSAGE_LIMIT = 100000  # The real limiting factor seems to be total transaction size
 
+# Below this many inputs a process pool costs more than it saves.
+PARALLEL_SIGNING_THRESHOLD = 200
+
 
 class TxIn:
-    __slots__ = ('script', 'script_len', 'txid', 'txindex', 'amount')
+    __slots__ = ('script', 'script_len', 'txid', 'txindex', 'amount', 'sequence')
 
-    def __init__(self, script, script_len, txid, txindex, amount):
+    def __init__(self, script, script_len, txid, txindex, amount, sequence=SEQUENCE):
         self.script = script
         self.script_len = script_len
         self.txid = txid
         self.txindex = txindex
         self.amount = amount
+        self.sequence = sequence
 
     def __eq__(self, other):
         return (self.script == other.script and
                 self.script_len == other.script_len and
                 self.txid == other.txid and
                 self.txindex == other.txindex and
-                self.amount == other.amount)
+                self.amount == other.amount and
+                self.sequence == other.sequence)
 
     def __repr__(self):
-        return 'TxIn({}, {}, {}, {}, {})'.format(
+        return 'TxIn({}, {}, {}, {}, {}, {})'.format(
             repr(self.script),
             repr(self.script_len),
             repr(self.txid),
             repr(self.txindex),
-            repr(self.amount)
+            repr(self.amount),
+            repr(self.sequence)
+        )
+
+
+class TxOut:
+    __slots__ = ('amount', 'script')
+
+    def __init__(self, amount, script):
+        self.amount = amount
+        self.script = script
+
+    def __eq__(self, other):
+        return (self.amount == other.amount and
+                self.script == other.script)
+
+    def __repr__(self):
+        return 'TxOut({}, {})'.format(
+            repr(self.amount),
+            repr(self.script)
         )
 
 
+class Transaction:
+    """A transaction held as bytes, with serialization, txid and size cached.
+
+    ``version`` and ``lock_time`` are 4 raw bytes, ``inputs`` are TxIn and
+    ``outputs`` TxOut. The output block is serialized once and shared with the
+    sighash engine; the full serialization is cached on first use, so inputs
+    must be signed before ``serialize``/``txid``/``hex`` are called.
+    """
+    __slots__ = ('version', 'inputs', 'outputs', 'lock_time',
+                 '_output_block', '_output_spans', '_raw', '_txid')
+
+    def __init__(self, version, inputs, outputs, lock_time):
+        self.version = version
+        self.inputs = inputs
+        self.outputs = outputs
+        self.lock_time = lock_time
+        self._output_block = None
+        self._output_spans = None
+        self._raw = None
+        self._txid = None
+
+    def __repr__(self):
+        return '<Transaction: {} inputs, {} outputs>'.format(len(self.inputs), len(self.outputs))
+
+    @classmethod
+    def from_bytes(cls, data):
+        tx = TransactionView(data)
+        view = tx.view
+        inputs = [input_from_view(txin) for txin in tx.inputs]
+        outputs = [TxOut(txout.amount, bytes(txout.script)) for txout in tx.outputs]
+        transaction = cls(bytes(view[:4]), inputs, outputs, bytes(view[-4:]))
+        transaction._raw = bytes(view)
+        return transaction
+
+    @classmethod
+    def from_hex(cls, hexed):
+        return cls.from_bytes(bytes.fromhex(hexed))
+
+    def output_block(self):
+        """Serialized outputs without their count varint."""
+        if self._output_block is None:
+            writer = TxWriter()
+            spans = []
+            for txout in self.outputs:
+                start = len(writer)
+                writer.write_output(txout.amount, txout.script)
+                spans.append((start, len(writer)))
+            self._output_block = writer.getvalue()
+            self._output_spans = spans
+        return self._output_block
+
+    def serialized_outputs(self):
+        """Each serialized output as a memoryview slice of ``output_block()``."""
+        view = memoryview(self.output_block())
+        return [view[start:end] for start, end in self._output_spans]
+
+    def input_block(self):
+        """Serialized inputs including their count varint."""
+        writer = TxWriter()
+        writer.write_varint(len(self.inputs))
+        for txin in self.inputs:
+            writer.write_input(txin)
+        return writer.getvalue()
+
+    def serialize(self):
+        if self._raw is None:
+            writer = TxWriter()
+            writer.write(self.version)
+            writer.write_varint(len(self.inputs))
+            for txin in self.inputs:
+                writer.write_input(txin)
+            writer.write_varint(len(self.outputs))
+            writer.write(self.output_block())
+            writer.write(self.lock_time)
+            self._raw = writer.getvalue()
+        return self._raw
+
+    @property
+    def txid(self):
+        if self._txid is None:
+            self._txid = bytes_to_hex(double_sha256(self.serialize())[::-1])
+        return self._txid
+
+    @property
+    def size(self):
+        return len(self.serialize())
+
+    def hex(self):
+        return self.serialize().hex()
+
+
+class TxWriter:
+    """Appends transaction fields to one growing bytearray.
+
+    Each write extends the buffer in place (amortized O(1)), so building a
+    transaction is linear in its size. ``view()`` exposes the buffer without
+    copying; ``getvalue()`` copies it once into bytes.
+    """
+    __slots__ = ('buffer',)
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+
+    def write_varint(self, val):
+        self.buffer += int_to_varint(val)
+
+    def write_uint32(self, val):
+        self.buffer += val.to_bytes(4, byteorder='little')
+
+    def write_uint64(self, val):
+        self.buffer += val.to_bytes(8, byteorder='little')
+
+    def write_script(self, script):
+        self.buffer += int_to_varint(len(script))
+        self.buffer += script
+
+    def write_output(self, amount, script):
+        self.write_uint64(amount)
+        self.write_script(script)
+
+    def write_input(self, txin):
+        buffer = self.buffer
+        buffer += txin.txid
+        buffer += txin.txindex
+        buffer += txin.script_len
+        buffer += txin.script
+        buffer += txin.sequence
+
+    def view(self):
+        return memoryview(self.buffer)
+
+    def getvalue(self):
+        return bytes(self.buffer)
+
+
 Output = namedtuple('Output', ('address', 'amount', 'currency'))
 
 
@@ -151,9 +323,10 @@ def get_op_pushdata_code(dest):
 
 
 
-def construct_output_block(outputs, custom_pushdata=False):
+def make_outputs(outputs, custom_pushdata=False):
+    """Turns (destination, amount) pairs into TxOut objects."""
 
-    output_block = b''
+    txouts = []
 
     for data in outputs:
         dest, amount = data
@@ -164,59 +337,198 @@ def construct_output_block(outputs, custom_pushdata=False):
                       address_to_public_key_hash(dest) +
                       OP_EQUALVERIFY + OP_CHECKSIG)
 
-            output_block += amount.to_bytes(8, byteorder='little')
-
         # Blockchain storage
         else:
+            amount = 0
             if custom_pushdata is False:
-                script = OP_FALSE + OP_RETURN + get_op_pushdata_code(dest) + dest
-
-                output_block += b'\x00\x00\x00\x00\x00\x00\x00\x00'
+                script = b''.join((OP_FALSE, OP_RETURN, get_op_pushdata_code(dest), dest))
 
             elif custom_pushdata is True:
                 # manual control over number of bytes in each batch of pushdata
                 if type(dest) != bytes:
                     raise TypeError("custom pushdata must be of type: bytes")
                 else:
-                    script = (OP_FALSE + OP_RETURN + dest)
-
-                output_block += b'\x00\x00\x00\x00\x00\x00\x00\x00'
+                    script = b''.join((OP_FALSE, OP_RETURN, dest))
 
         # Script length in wiki is "Var_int" but there's a note of "modern BitcoinQT" using a more compact "CVarInt"
-        output_block += int_to_varint(len(script))
-        output_block += script
+        txouts.append(TxOut(amount, script))
 
-    return output_block
+    return txouts
 
-def construct_input_block(inputs):
 
-    input_block = b''
-    sequence = SEQUENCE
+def construct_outputs(outputs, custom_pushdata=False):
+    """Serialized outputs as memoryview slices of one shared output block."""
+    return Transaction(VERSION_1, [], make_outputs(outputs, custom_pushdata=custom_pushdata), LOCK_TIME).serialized_outputs()
+
+
+def construct_output_block(outputs, custom_pushdata=False):
+    return Transaction(VERSION_1, [], make_outputs(outputs, custom_pushdata=custom_pushdata), LOCK_TIME).output_block()
+
 
+def construct_input_block(inputs):
+    writer = TxWriter()
     for txin in inputs:
-        input_block += (
+        writer.write_input(txin)
+    return writer.getvalue()
+
+
+class SighashEngine:
+    """BIP-143 (FORKID) signature hashes for every input of one transaction.
+
+    hashPrevouts, hashSequence and hashOutputs are computed once per
+    transaction, and the 68-byte ``version + hashPrevouts + hashSequence``
+    prefix is kept as a SHA-256 midstate, so each input only hashes its tail.
+    """
+    __slots__ = ('inputs', 'outputs', 'version', 'lock_time', 'sequence',
+                 '_hash_prevouts', '_hash_sequence', '_hash_outputs', '_midstates')
+
+    def __init__(self, inputs, outputs, version=VERSION_1, lock_time=LOCK_TIME, sequence=SEQUENCE):
+        self.inputs = inputs
+        self.outputs = outputs  # serialized outputs, see construct_outputs
+        self.version = version
+        self.lock_time = lock_time
+        self.sequence = sequence
+        self._hash_prevouts = None
+        self._hash_sequence = None
+        self._hash_outputs = None
+        self._midstates = {}
+
+    def hash_prevouts(self):
+        if self._hash_prevouts is None:
+            self._hash_prevouts = double_sha256(b''.join([i.txid + i.txindex for i in self.inputs]))
+        return self._hash_prevouts
+
+    def hash_sequence(self):
+        if self._hash_sequence is None:
+            self._hash_sequence = double_sha256(self.sequence * len(self.inputs))
+        return self._hash_sequence
+
+    def hash_outputs(self, hash_type, index):
+        base_type = hash_type & 0x1f
+        if base_type == SIGHASH_SINGLE:
+            if index < len(self.outputs):
+                return double_sha256(self.outputs[index])
+            return ZERO_HASH
+        if base_type == SIGHASH_NONE:
+            return ZERO_HASH
+        if self._hash_outputs is None:
+            self._hash_outputs = double_sha256(b''.join(self.outputs))
+        return self._hash_outputs
+
+    def midstate(self, hash_type):
+        anyonecanpay = bool(hash_type & SIGHASH_ANYONECANPAY)
+        key = (anyonecanpay, hash_type & 0x1f)
+        state = self._midstates.get(key)
+        if state is None:
+            hash_prevouts = ZERO_HASH if anyonecanpay else self.hash_prevouts()
+            if anyonecanpay or key[1] in (SIGHASH_SINGLE, SIGHASH_NONE):
+                hash_sequence = ZERO_HASH
+            else:
+                hash_sequence = self.hash_sequence()
+            state = _sha256(self.version + hash_prevouts + hash_sequence)
+            self._midstates[key] = state
+        return state
+
+    def sighash(self, index, script_code, hash_type=HASH_TYPE):
+        """Returns sha256(preimage); ``bsv.sign`` applies the second SHA-256."""
+        if not hash_type & SIGHASH_FORKID:
+            raise ValueError('only FORKID sighash types are supported')
+        txin = self.inputs[index]
+        state = self.midstate(hash_type).copy()
+        state.update(
             txin.txid +
             txin.txindex +
-            txin.script_len +
-            txin.script +
-            sequence
+            int_to_varint(len(script_code)) +
+            script_code +
+            txin.amount +
+            self.sequence +
+            self.hash_outputs(hash_type, index) +
+            self.lock_time +
+            hash_type.to_bytes(4, byteorder='little')
         )
+        return state.digest()
 
-    return input_block
+    def split(self, start, stop, hash_type=HASH_TYPE):
+        """Engine over ``inputs[start:stop]`` sharing this transaction's hashes.
 
+        Input indices restart at 0, so only sighash types that do not depend on
+        the input position (ALL, NONE) can be split.
+        """
+        if hash_type & 0x1f == SIGHASH_SINGLE:
+            raise ValueError('SIGHASH_SINGLE depends on the input index and cannot be split')
+        part = SighashEngine(self.inputs[start:stop], [], version=self.version,
+                             lock_time=self.lock_time, sequence=self.sequence)
+        part._hash_prevouts = self.hash_prevouts()
+        part._hash_sequence = self.hash_sequence()
+        part._hash_outputs = self.hash_outputs(hash_type, start)
+        return part
 
-def create_p2pkh_transaction(utxosets, outputs, custom_pushdata=False):
 
-    version = VERSION_1
-    lock_time = LOCK_TIME
-    # sequence = SEQUENCE
-    hash_type = HASH_TYPE
-    unspents = [Unspent.from_dict(utxo) for utxo in utxosets]
-    input_count = int_to_varint(len(unspents))
-    output_count = int_to_varint(len(outputs))
-    
+def sign_input(engine, index, key, hash_type=HASH_TYPE):
+    public_key = key.public_key
+    public_key_len = len(public_key).to_bytes(1, byteorder='little')
+
+    # scriptCode_len is part of the script.
+    hashed = engine.sighash(index, key.script_code, hash_type)  # BIP-143: Used for Bitcoin SV
+
+    signature = key.sign(hashed) + hash_type.to_bytes(1, byteorder='little')
+
+    script_sig = (
+        len(signature).to_bytes(1, byteorder='little') +
+        signature +
+        public_key_len +
+        public_key
+    )
+
+    txin = engine.inputs[index]
+    txin.script = script_sig
+    txin.script_len = int_to_varint(len(script_sig))
+
+
+def _sign_chunk(job):
+    engine, keys, hash_type = job
+    for i, key in enumerate(keys):
+        sign_input(engine, i, key, hash_type)
+    return [txin.script for txin in engine.inputs]
+
 
-    output_block = construct_output_block(outputs, custom_pushdata=custom_pushdata)
+def sign_inputs(engine, keys, hash_type=HASH_TYPE, processes=None, parallel_threshold=PARALLEL_SIGNING_THRESHOLD):
+    """Signs every input of ``engine`` with the matching KeyHandle in ``keys``.
+
+    With ``processes`` > 1 and at least ``parallel_threshold`` inputs the work is
+    spread over a process pool; the resulting scripts are identical to the
+    serial path because signing is deterministic (RFC 6979).
+    """
+    n = len(engine.inputs)
+    if not processes or processes <= 1 or n < parallel_threshold:
+        for i in range(n):
+            sign_input(engine, i, keys[i], hash_type)
+        return
+
+    chunk_size = -(-n // (processes * 4))
+    jobs = [(engine.split(start, start + chunk_size, hash_type), keys[start:start + chunk_size], hash_type)
+            for start in range(0, n, chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        scripts = [script for chunk in executor.map(_sign_chunk, jobs) for script in chunk]
+
+    for txin, script_sig in zip(engine.inputs, scripts):
+        txin.script = script_sig
+        txin.script_len = int_to_varint(len(script_sig))
+
+
+def utxo_key(utxo):
+    """KeyHandle for a UTXO dict, reusing PublicKey/PublicKeyHash columns when present."""
+    public_key = utxo.get('PublicKey')
+    hash160 = utxo.get('PublicKeyHash')
+    return key_handle(utxo['PrivateKey'],
+                      hex_to_bytes(public_key) if public_key else None,
+                      hex_to_bytes(hash160) if hash160 else None)
+
+
+def build_p2pkh_transaction(utxosets, outputs, custom_pushdata=False, processes=None,
+                            parallel_threshold=PARALLEL_SIGNING_THRESHOLD):
+
+    unspents = [Unspent.from_dict(utxo) for utxo in utxosets]
 
     # Optimize for speed, not memory, by pre-computing values.
     inputs = []
@@ -227,157 +539,282 @@ def create_p2pkh_transaction(utxosets, outputs, custom_pushdata=False):
 
         inputs.append(TxIn('', 0, txid, txindex, amount))
 
-    hashPrevouts = double_sha256(b''.join([i.txid+i.txindex for i in inputs]))
-    hashSequence = double_sha256(b''.join([SEQUENCE for i in inputs]))
-    hashOutputs = double_sha256(output_block)
-
-    # scriptCode_len is part of the script.
-    for i, txin in enumerate(inputs):
-        private_key = bsv(wif=utxosets[i]['PrivateKey'])
-        public_key = bytes.fromhex(private_key.public_key)
-        public_key_len = len(public_key).to_bytes(1, byteorder='little')
-
-        scriptCode = (OP_DUP + OP_HASH160 + OP_PUSH_20 + address_to_public_key_hash(private_key.address) + OP_EQUALVERIFY + OP_CHECKSIG)
-        scriptCode_len = int_to_varint(len(scriptCode))
-        to_be_hashed = (
-            version +
-            hashPrevouts +
-            hashSequence +
-            txin.txid +
-            txin.txindex +
-            scriptCode_len +
-            scriptCode +
-            txin.amount +
-            SEQUENCE +
-            hashOutputs +
-            lock_time +
-            hash_type
-        )
-        hashed = sha256(to_be_hashed)  # BIP-143: Used for Bitcoin SV
-
-        # signature = private_key.sign(hashed) + b'\x01'
-        signature = private_key.sign(hashed) + b'\x41'
-        
-        script_sig = (
-            len(signature).to_bytes(1, byteorder='little') +
-            signature +
-            public_key_len +
-            public_key
-        )
-
-        inputs[i].script = script_sig
-        inputs[i].script_len = int_to_varint(len(script_sig))
-
-    return bytes_to_hex(
-        version +
-        input_count +
-        construct_input_block(inputs) +
-        output_count +
-        output_block +
-        lock_time
-    )
-
-
-def create_transaction(utxosets,output,exchange_address):
-    fee = estimate_tx_fee(len(utxosets),2,0.5,True,0)
-    input_amount = 0
-    for item in utxosets:
-        input_amount += item['amount']
-    output_amount = output[1]
-    leftamount = input_amount - output_amount - fee
-    if leftamount > 546:
+    tx = Transaction(VERSION_1, inputs, make_outputs(outputs, custom_pushdata=custom_pushdata), LOCK_TIME)
+    engine = SighashEngine(inputs, tx.serialized_outputs(), version=tx.version, lock_time=tx.lock_time)
+    sign_inputs(engine, [utxo_key(utxo) for utxo in utxosets], HASH_TYPE,
+                processes=processes, parallel_threshold=parallel_threshold)
+    return tx
+
+
+def create_p2pkh_transaction(utxosets, outputs, custom_pushdata=False, processes=None,
+                             parallel_threshold=PARALLEL_SIGNING_THRESHOLD):
+    return build_p2pkh_transaction(utxosets, outputs, custom_pushdata=custom_pushdata, processes=processes,
+                                   parallel_threshold=parallel_threshold).hex()
+
+
+def create_transaction(utxosets,output,exchange_address,processes=None,fee_rate=None):
+    # Only the UTXOs picked by coin selection are spent; 'spent' lists them as (txid, txindex).
+    if fee_rate is None:
+        fee_rate = fee_quotes.rate()
+    payment = make_outputs([output])
+    selection = select_coins(utxosets, output[1], fee_rate, n_outputs=1,
+                             outputs_size=sum(output_size(len(txout.script)) for txout in payment))
+    utxosets = selection.utxos
+    input_amount = selection.amount
+    spent = [(item['txid'], item['txindex']) for item in utxosets]
+    fee, leftamount = settle_fee(input_amount, len(utxosets), payment, fee_rate)
+    if leftamount > DUST:
         outputs = [output,(exchange_address,leftamount)]   #output is tuple
-        rawtx = create_p2pkh_transaction(utxosets, outputs)
+        tx = build_p2pkh_transaction(utxosets, outputs, processes=processes)
         utxoset = {}
-        utxoset['txid'] = calc_txid(rawtx)
+        utxoset['txid'] = tx.txid
         utxoset['txindex'] = 1
         utxoset['amount'] = leftamount
         utxoset['confirmations'] = 0
-        return {'rawtx':rawtx,'utxoset':utxoset,'txid': calc_txid(rawtx),'amount': input_amount-leftamount}.copy()
+        return {'rawtx':tx.hex(),'utxoset':utxoset,'txid': tx.txid,'amount': input_amount-leftamount,'spent': spent}
     else:
         outputs = [output]
-        rawtx = create_p2pkh_transaction(utxosets, outputs)
-        return {'rawtx':rawtx,'utxoset': None,'txid': calc_txid(rawtx),'amount': input_amount}.copy()
-    
+        tx = build_p2pkh_transaction(utxosets, outputs, processes=processes)
+        return {'rawtx':tx.hex(),'utxoset': None,'txid': tx.txid,'amount': input_amount,'spent': spent}
 
-    
 
-def sweep(utxosets,address):
-    fee = estimate_tx_fee(len(utxosets),1,0.5,True,0)
+def sweep(utxosets,address,processes=None,fee_rate=None):
+    if fee_rate is None:
+        fee_rate = fee_quotes.rate()
     input_amount = 0
     for item in utxosets:
         input_amount += item['amount']
+    size = transaction_size(len(utxosets), len(utxosets) * P2PKH_INPUT_SIZE, 1, P2PKH_OUTPUT_SIZE)
+    fee = fee_for_size(size, fee_rate)
     leftamount = input_amount - fee
+    if leftamount <= DUST:
+        raise InsufficientFunds('Balance {} leaves {} after the {} fee, no more than dust.'.format(
+            input_amount, leftamount, fee))
     outputs = [(address,leftamount)]
-    rawtx = create_p2pkh_transaction(utxosets, outputs)
-    return {'rawtx':rawtx,'utxoset': None,'txid': calc_txid(rawtx),'amount': input_amount}.copy()
+    tx = build_p2pkh_transaction(utxosets, outputs, processes=processes)
+    return {'rawtx':tx.hex(),'utxoset': None,'txid': tx.txid,'amount': input_amount}
+
+
+class TxReader:
+    """Forward cursor over a memoryview; every read returns a zero-copy slice."""
+    __slots__ = ('view', 'offset')
+
+    def __init__(self, data, offset=0):
+        self.view = data if isinstance(data, memoryview) else memoryview(data)
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.view) - self.offset
+
+    def read(self, n):
+        start = self.offset
+        end = start + n
+        if end > len(self.view):
+            raise ValueError('transaction data truncated at offset {}'.format(start))
+        self.offset = end
+        return self.view[start:end]
+
+    def skip(self, n):
+        self.read(n)
+
+    def read_uint32(self):
+        return int.from_bytes(self.read(4), 'little')
+
+    def read_uint64(self):
+        return int.from_bytes(self.read(8), 'little')
+
+    def read_varint(self):
+        prefix = self.read(1)[0]
+        if prefix < 0xfd:
+            return prefix
+        if prefix == 0xfd:
+            return int.from_bytes(self.read(2), 'little')
+        if prefix == 0xfe:
+            return int.from_bytes(self.read(4), 'little')
+        return int.from_bytes(self.read(8), 'little')
+
+
+class InputView:
+    """One input of a parsed transaction; fields are decoded on access."""
+    __slots__ = ('view', 'start', 'script_start', 'script_end')
+
+    def __init__(self, view, start, script_start, script_end):
+        self.view = view
+        self.start = start
+        self.script_start = script_start
+        self.script_end = script_end
+
+    @property
+    def end(self):
+        return self.script_end + 4
+
+    @property
+    def txid(self):
+        return bytes(self.view[self.start:self.start + 32][::-1]).hex()
+
+    @property
+    def txindex(self):
+        return int.from_bytes(self.view[self.start + 32:self.start + 36], 'little')
 
+    @property
+    def script(self):
+        return self.view[self.script_start:self.script_end]
 
+    @property
+    def sequence(self):
+        return int.from_bytes(self.view[self.script_end:self.script_end + 4], 'little')
+
+    def raw(self):
+        return self.view[self.start:self.end]
+
+
+class OutputView:
+    """One output of a parsed transaction; fields are decoded on access."""
+    __slots__ = ('view', 'start', 'script_start', 'script_end')
+
+    def __init__(self, view, start, script_start, script_end):
+        self.view = view
+        self.start = start
+        self.script_start = script_start
+        self.script_end = script_end
+
+    @property
+    def end(self):
+        return self.script_end
+
+    @property
+    def amount(self):
+        return int.from_bytes(self.view[self.start:self.start + 8], 'little')
+
+    @property
+    def script(self):
+        return self.view[self.script_start:self.script_end]
+
+    def raw(self):
+        return self.view[self.start:self.end]
+
+
+def read_inputs(reader):
+    """Reads a varint-prefixed input list, recording offsets only."""
+    view = reader.view
+    inputs = []
+    for _ in range(reader.read_varint()):
+        start = reader.offset
+        reader.skip(36)
+        script_len = reader.read_varint()
+        script_start = reader.offset
+        reader.skip(script_len)
+        inputs.append(InputView(view, start, script_start, reader.offset))
+        reader.skip(4)
+    return inputs
+
+
+def read_outputs(reader):
+    """Reads a varint-prefixed output list, recording offsets only."""
+    view = reader.view
+    outputs = []
+    for _ in range(reader.read_varint()):
+        start = reader.offset
+        reader.skip(8)
+        script_len = reader.read_varint()
+        script_start = reader.offset
+        reader.skip(script_len)
+        outputs.append(OutputView(view, start, script_start, reader.offset))
+    return outputs
+
+
+def input_from_view(txin):
+    """Copies a parsed InputView into a TxIn (amount is unknown, so None)."""
+    view = txin.view
+    return TxIn(bytes(txin.script), int_to_varint(txin.script_end - txin.script_start),
+                bytes(view[txin.start:txin.start + 32]), bytes(view[txin.start + 32:txin.start + 36]),
+                None, bytes(view[txin.script_end:txin.end]))
+
+
+class TransactionView:
+    """Single-pass, zero-copy parse of a serialized transaction.
+
+    Only offsets are recorded while parsing, so the cost is linear in the
+    number of inputs and outputs regardless of script sizes. ``inputs_span``
+    and ``outputs_span`` are the (start, end) offsets of each section,
+    including its count varint, for re-serializing or hashing slices.
+    """
+    __slots__ = ('view', 'inputs', 'outputs', 'inputs_span', 'outputs_span')
+
+    def __init__(self, data):
+        reader = TxReader(data)
+        self.view = reader.view
+        reader.skip(4)
+        start = reader.offset
+        self.inputs = read_inputs(reader)
+        self.inputs_span = (start, reader.offset)
+        start = reader.offset
+        self.outputs = read_outputs(reader)
+        self.outputs_span = (start, reader.offset)
+        reader.skip(4)
+        if len(reader):
+            raise ValueError('{} trailing bytes after transaction'.format(len(reader)))
+
+    @property
+    def version(self):
+        return int.from_bytes(self.view[:4], 'little')
+
+    @property
+    def lock_time(self):
+        return int.from_bytes(self.view[-4:], 'little')
+
+    def section(self, span):
+        return self.view[span[0]:span[1]]
 
 
 def deserialize_input(rawinput):
-    input_count = int(rawinput[:2],16)
-    input_list = []
-    remain_input = rawinput[2:]
-    key_list = ['txid','txindex','script_len','script','sequence']
-    for i in range(input_count):
-        input_list.append({})
-        for key in key_list:
-            if key == 'txid':
-                input_list[-1][key] = bytes.fromhex(remain_input[:64])[::-1].hex()
-                remain_input = remain_input[64:]
-            elif key == 'txindex':
-                input_list[-1][key] = int.from_bytes(bytes.fromhex(remain_input[:8]), 'little')
-                remain_input = remain_input[8:]
-            elif key == 'script_len':
-                input_list[-1][key] = int(remain_input[:2],16)
-                remain_input = remain_input[2:]
-            elif key == 'script':
-                input_list[-1][key] = remain_input[:input_list[-1]['script_len']*2]
-                remain_input = remain_input[input_list[-1]['script_len']*2:]
-            elif key == 'sequence':
-                input_list[-1][key] = int(remain_input[:8],16)
-                remain_input = remain_input[8:]
-    return input_list
-
-
-def get_rawtx_to_pay(sighash_single_rawtx,pay_to_address):
-    est_size_of_rawHex = len(sighash_single_rawtx['version']) +\
-                         len(sighash_single_rawtx['input']) + \
-                        len(int_to_varint(2).hex()) + \
-                        len(sighash_single_rawtx["output"]) + \
-                        len(sighash_single_rawtx['lock_time']) + \
-                        16 + 2 + 50   # amount: 8 bytes  script_len： 1 byte  script: 25bytes
-    rawtx_single_json = deserialize_input(sighash_single_rawtx['input'])
-    
-    input_amount = 0
-    for item in rawtx_single_json:
-        result = get_tx_by_txid(item['txid'])
-        input_amount += int(result['vout'][item['txindex']]['value']*100000000)
-    output_amount = int.from_bytes(bytes.fromhex(sighash_single_rawtx['output'][:8]),'little')
-    
-    amount = int(input_amount - output_amount - est_size_of_rawHex/4)   #fee rate: 0.5sat/B
+    reader = TxReader(bytes.fromhex(rawinput))
+    return [{'txid': txin.txid,
+             'txindex': txin.txindex,
+             'script_len': txin.script_end - txin.script_start,
+             'script': txin.script.hex(),
+             'sequence': txin.sequence} for txin in read_inputs(reader)]
+
+
+def get_rawtx_to_pay(sighash_single_rawtx,pay_to_address,fee_rate=None,tx_cache=None):
+    if fee_rate is None:
+        fee_rate = fee_quotes.rate()
+    if tx_cache is None:
+        # txcache builds on this module, so it is imported on first use.
+        from txcache import get_tx_cache
+        tx_cache = get_tx_cache()
+    input_reader = TxReader(bytes.fromhex(sighash_single_rawtx['input']))
+    signed_inputs = read_inputs(input_reader)
+    if len(input_reader):
+        raise ValueError('unexpected data after inputs')
+    signed_outputs = read_outputs(TxReader(int_to_varint(1) + bytes.fromhex(sighash_single_rawtx['output'])))
+
+    # Parent output values come from the local transaction cache; misses are fetched together.
+    input_amount = sum(tx_cache.output_amounts((txin.txid, txin.txindex) for txin in signed_inputs))
+    output_amount = signed_outputs[0].amount
+
+    # The inputs are already signed, so the final size is exact.
+    size = transaction_size(len(signed_inputs), sum(txin.end - txin.start for txin in signed_inputs),
+                            2, output_size(len(signed_outputs[0].script)) + P2PKH_OUTPUT_SIZE)
+    fee = fee_for_size(size, fee_rate)
+    amount = input_amount - output_amount - fee
+    if amount <= DUST:
+        raise InsufficientFunds('Authorized {} leaves {} after the {} fee, no more than dust.'.format(
+            input_amount - output_amount, amount, fee))
 
-    output_count = int_to_varint(2)
-    output_block = bytes.fromhex(sighash_single_rawtx["output"])
     output_script = (OP_DUP +OP_HASH160 + OP_PUSH_20 + address_to_public_key_hash(pay_to_address)+ OP_EQUALVERIFY + OP_CHECKSIG)
-    output_block += (amount).to_bytes(8, byteorder='little')   #satoshi
-    output_block += int_to_varint(len(output_script))
-    output_block += output_script
-    rawtx = ''
-    rawtx += sighash_single_rawtx['version']
-    rawtx += sighash_single_rawtx['input']
-    rawtx += output_count.hex()
-    rawtx += output_block.hex()
-    rawtx += sighash_single_rawtx['lock_time']
+    tx = Transaction(bytes.fromhex(sighash_single_rawtx['version']),
+                     [input_from_view(txin) for txin in signed_inputs],
+                     [TxOut(signed_outputs[0].amount, bytes(signed_outputs[0].script)), TxOut(amount, output_script)],
+                     bytes.fromhex(sighash_single_rawtx['lock_time']))
 
     utxoset = {}
-    utxoset['txid'] = calc_txid(rawtx)
+    utxoset['txid'] = tx.txid
     utxoset['txindex'] = 1
     utxoset['amount'] = amount
     utxoset['confirmations'] = 0
 
-    return {'rawtx':rawtx,'utxoset':utxoset,'txid': calc_txid(rawtx),'amount':amount}.copy()
+    return {'rawtx':tx.hex(),'utxoset':utxoset,'txid': tx.txid,'amount':amount}
 
 def generate_sighash_single_rawtx(utxosets, changeaddress,authrized_amount):
     unspents = [Unspent.from_dict(utxo) for utxo in utxosets]
@@ -386,8 +823,6 @@ def generate_sighash_single_rawtx(utxosets, changeaddress,authrized_amount):
     #sequence = SEQUENCE
     
     
-    input_count = int_to_varint(len(unspents))
-    
     inputs = []
     total_input_amount = 0
     for unspent in unspents:
@@ -399,69 +834,83 @@ def generate_sighash_single_rawtx(utxosets, changeaddress,authrized_amount):
     
     
     
-    output_count = int_to_varint(1)
-    output_block = b''
     output_script = (OP_DUP +OP_HASH160 + OP_PUSH_20 + address_to_public_key_hash(changeaddress)+ OP_EQUALVERIFY + OP_CHECKSIG)
-    output_block += (total_input_amount-authrized_amount).to_bytes(8, byteorder='little')   #satoshi
-    output_block += int_to_varint(len(output_script))
-    output_block += output_script
+    tx = Transaction(version, inputs, [TxOut(total_input_amount-authrized_amount, output_script)], lock_time)   #satoshi
 
-    
-
-    hashPrevouts = double_sha256(b''.join([i.txid+i.txindex for i in inputs]))
-    hashSequence = bytes.fromhex('0000000000000000000000000000000000000000000000000000000000000000')
-    # scriptCode_len is part of the script.
-    for i, txin in enumerate(inputs):
-        if i==0:
-            hashOutputs = double_sha256(output_block)
-            hash_type = 0x43.to_bytes(4, byteorder='little')  #sighash single
-        else:
-            hashOutputs = bytes.fromhex('0000000000000000000000000000000000000000000000000000000000000000')
-            hash_type = 0x42.to_bytes(4, byteorder='little')  #sighash none
-
-        private_key = bsv(utxosets[i]['PrivateKey'])
-        public_key = bytes.fromhex(private_key.public_key)
-        public_key_len = len(public_key).to_bytes(1, byteorder='little')
-        scriptCode = (OP_DUP + OP_HASH160 + OP_PUSH_20 + address_to_public_key_hash(private_key.address) + OP_EQUALVERIFY + OP_CHECKSIG)
-        scriptCode_len = int_to_varint(len(scriptCode))
-        to_be_hashed = (
-            version +
-            hashPrevouts +
-            hashSequence +
-            txin.txid +
-            txin.txindex +
-            scriptCode_len +
-            scriptCode +
-            txin.amount +
-            SEQUENCE +
-            hashOutputs +
-            lock_time +
-            hash_type
-        )
-        hashed = sha256(to_be_hashed)  # BIP-143: Used for Bitcoin SV
-
-        # signature = private_key.sign(hashed) + b'\x01'   sighash ALL  ; single b'\x03' ,NONE b'\x02'
+    # Input 0 commits to the change output (SINGLE), the rest to no outputs (NONE),
+    # so the payer can append their own output later.
+    engine = SighashEngine(inputs, tx.serialized_outputs(), version=version, lock_time=lock_time)
+    for i in range(len(inputs)):
         if i==0:
-            signature = private_key.sign(hashed) + b'\x43'
+            hash_type = SIGHASH_SINGLE | SIGHASH_FORKID
         else:
-            signature = private_key.sign(hashed) + b'\x42'
+            hash_type = SIGHASH_NONE | SIGHASH_FORKID
+        sign_input(engine, i, utxo_key(utxosets[i]), hash_type)
 
-        script_sig = (
-            len(signature).to_bytes(1, byteorder='little') +
-            signature +
-            public_key_len +
-            public_key
-        )
-
-        inputs[i].script = script_sig
-        inputs[i].script_len = int_to_varint(len(script_sig))
-        
-            
     return {"version": bytes_to_hex(version),
-            "input" : bytes_to_hex(input_count + construct_input_block(inputs) ),
-            "output" : bytes_to_hex(output_block),
+            "input" : bytes_to_hex(tx.input_block()),
+            "output" : bytes_to_hex(tx.output_block()),
             "lock_time" : bytes_to_hex(lock_time) }
 
+# Payment request QR text: PAYMENT_REQUEST_PREFIX + Base45 of
+#   format version (1) | tx version (4) | input block with count | change output | lock_time (4) | checksum (4)
+# Base45 stays in the QR alphanumeric set, about 8.25 bits per byte against 16 for the hex dict of the
+# legacy format (str() of the dict generate_sighash_single_rawtx returns), which is still accepted.
+PAYMENT_REQUEST_PREFIX = 'BSVPR:'
+PAYMENT_REQUEST_VERSION = 1
+PAYMENT_REQUEST_CHECKSUM = 4  # bytes of double SHA-256
+
+_LEGACY_ITEM = r"'(version|input|output|lock_time)': '((?:[0-9a-f]{2})*)'"
+LEGACY_PAYMENT_REQUEST = re.compile(r"\{{{0}, {0}, {0}, {0}\}}".format(_LEGACY_ITEM))
+
+
+def encode_payment_request(sighash_single_rawtx):
+    """QR text for a generate_sighash_single_rawtx result."""
+    body = (PAYMENT_REQUEST_VERSION.to_bytes(1, 'little') +
+            b''.join(bytes.fromhex(sighash_single_rawtx[key]) for key in ('version', 'input', 'output', 'lock_time')))
+    return PAYMENT_REQUEST_PREFIX + base45_encode(body + double_sha256(body)[:PAYMENT_REQUEST_CHECKSUM])
+
+
+def split_payment_request(data):
+    """Splits version | inputs | one output | lock_time into the generate_sighash_single_rawtx dict."""
+    reader = TxReader(data)
+    version = reader.read(4)
+    start = reader.offset
+    if not read_inputs(reader):
+        raise ValueError('payment request has no inputs')
+    input_block = reader.view[start:reader.offset]
+    start = reader.offset
+    reader.skip(8)
+    reader.skip(reader.read_varint())
+    output = reader.view[start:reader.offset]
+    lock_time = reader.read(4)
+    if len(reader):
+        raise ValueError('{} trailing bytes after payment request'.format(len(reader)))
+    return {'version': bytes(version).hex(), 'input': bytes(input_block).hex(),
+            'output': bytes(output).hex(), 'lock_time': bytes(lock_time).hex()}
+
+
+def decode_payment_request(text):
+    """Parses payment request QR text, binary or legacy, into the generate_sighash_single_rawtx dict.
+
+    Raises ValueError for anything that is not a well-formed payment request.
+    """
+    if text.startswith(PAYMENT_REQUEST_PREFIX):
+        data = base45_decode(text[len(PAYMENT_REQUEST_PREFIX):])
+        body, checksum = data[:-PAYMENT_REQUEST_CHECKSUM], data[-PAYMENT_REQUEST_CHECKSUM:]
+        if not body or double_sha256(body)[:PAYMENT_REQUEST_CHECKSUM] != checksum:
+            raise ValueError('payment request checksum mismatch')
+        if body[0] != PAYMENT_REQUEST_VERSION:
+            raise ValueError('unsupported payment request version {}'.format(body[0]))
+        return split_payment_request(body[1:])
+    match = LEGACY_PAYMENT_REQUEST.fullmatch(text)
+    if match is None:
+        raise ValueError('not a payment request')
+    fields = dict(zip(match.groups()[::2], match.groups()[1::2]))
+    if len(fields) != 4:
+        raise ValueError('duplicate field in payment request')
+    return split_payment_request(b''.join(bytes.fromhex(fields[key]) for key in ('version', 'input', 'output', 'lock_time')))
+
 def convert_utxo_format(utxo_from_woc):
     utxo = {}
     utxo['txid'] = utxo_from_woc['tx_hash']
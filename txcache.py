@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import sqlite3
+import threading
+
+from crypto import double_sha256
+from network import BULK_TX_MAX, get_async_client, get_raw_txs_async
+from sync import SYNC_CONCURRENCY, TokenBucket, call_with_retries
+from transaction import TransactionView
+
+TX_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'txcache.sqlite3')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rawtx (
+    txid TEXT PRIMARY KEY,
+    raw BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS txout (
+    txid TEXT NOT NULL,
+    txindex INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (txid, txindex)
+) WITHOUT ROWID;
+"""
+
+
+def txid_of(raw):
+    return double_sha256(bytes(raw))[::-1].hex()
+
+
+async def fetch_raw_transactions_async(txids, bucket=None, concurrency=SYNC_CONCURRENCY):
+    """Raw transactions as {txid: bytes}, BULK_TX_MAX per request, ``concurrency`` requests at a time."""
+    bucket = bucket or TokenBucket()
+    semaphore = asyncio.Semaphore(concurrency)
+    result = {}
+
+    async def fetch_batch(batch):
+        async with semaphore:
+            entries = await call_with_retries(bucket, get_raw_txs_async, batch)
+        for entry in entries:
+            if entry.get('error'):
+                raise ValueError('raw transaction {} not available: {}'.format(entry.get('txid'), entry['error']))
+            result[entry['txid']] = bytes.fromhex(entry['hex'])
+
+    await asyncio.gather(*[fetch_batch(txids[i:i + BULK_TX_MAX]) for i in range(0, len(txids), BULK_TX_MAX)])
+    return result
+
+
+def fetch_raw_transactions(txids, **kwargs):
+    """Blocking wrapper around fetch_raw_transactions_async on a private event loop."""
+    async def run():
+        try:
+            return await fetch_raw_transactions_async(txids, **kwargs)
+        finally:
+            await get_async_client().close()
+    return asyncio.run(run())
+
+
+class TxCache:
+    """Persistent store of parent transactions keyed by txid.
+
+    A transaction's bytes are fixed by its txid, so entries never expire;
+    every fetched transaction is checked against its txid before it is kept.
+    Output values are indexed on insert, so amount lookups never re-parse.
+    """
+
+    def __init__(self, path=TX_CACHE_PATH, fetch=fetch_raw_transactions):
+        self.path = path
+        self.fetch = fetch
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def __contains__(self, txid):
+        return self.get(txid) is not None
+
+    def get(self, txid):
+        """Raw bytes of ``txid``, or None when it is not cached."""
+        with self._lock:
+            row = self._conn.execute('SELECT raw FROM rawtx WHERE txid = ?', (txid,)).fetchone()
+        return row[0] if row else None
+
+    def missing(self, txids):
+        wanted = list(dict.fromkeys(txids))
+        with self._lock:
+            found = set()
+            for i in range(0, len(wanted), 500):
+                chunk = wanted[i:i + 500]
+                found.update(row[0] for row in self._conn.execute(
+                    'SELECT txid FROM rawtx WHERE txid IN ({})'.format(','.join('?' * len(chunk))), chunk))
+        return [txid for txid in wanted if txid not in found]
+
+    def add(self, raw):
+        """Stores one raw transaction and indexes its outputs; returns its txid."""
+        txid = txid_of(raw)
+        self.add_many({txid: raw})
+        return txid
+
+    def add_many(self, raws):
+        """Stores {txid: raw bytes} in one transaction after checking each txid."""
+        rawtx_rows = []
+        txout_rows = []
+        for txid, raw in raws.items():
+            raw = bytes(raw)
+            if txid_of(raw) != txid:
+                raise ValueError('transaction data does not hash to {}'.format(txid))
+            rawtx_rows.append((txid, raw))
+            txout_rows.extend((txid, index, output.amount) for index, output in enumerate(TransactionView(raw).outputs))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO rawtx (txid, raw) VALUES (?, ?)', rawtx_rows)
+            self._conn.executemany('INSERT OR IGNORE INTO txout (txid, txindex, amount) VALUES (?, ?, ?)', txout_rows)
+
+    def prefetch(self, txids):
+        """Fetches every uncached txid in one concurrent round; returns how many were fetched."""
+        missing = self.missing(txids)
+        if missing:
+            self.add_many(self.fetch(missing))
+        return len(missing)
+
+    def output_amounts(self, outpoints):
+        """Satoshi values of (txid, txindex) outpoints, in order; misses are fetched first."""
+        outpoints = list(outpoints)
+        self.prefetch([txid for txid, _ in outpoints])
+        amounts = []
+        with self._lock:
+            for txid, txindex in outpoints:
+                row = self._conn.execute('SELECT amount FROM txout WHERE txid = ? AND txindex = ?',
+                                         (txid, txindex)).fetchone()
+                if row is None:
+                    raise ValueError('{} has no output {}'.format(txid, txindex))
+                amounts.append(row[0])
+        return amounts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_tx_cache = None
+
+
+def get_tx_cache():
+    global _tx_cache
+    if _tx_cache is None:
+        _tx_cache = TxCache()
+    return _tx_cache
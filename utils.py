@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import decimal
+import struct
 from binascii import hexlify
 import string
 
@@ -82,4 +83,35 @@ def asm_to_list(asm):
     return asm_list
 
 
-
+BASE45_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+# byte -> base45 value, 0xff for bytes outside the alphabet
+_BASE45_VALUES = bytes(BASE45_ALPHABET.encode().find(bytes([i])) % 256 for i in range(256))
+
+
+def base45_encode(data):
+    """RFC 9285 Base45; every character is in the QR alphanumeric set."""
+    pairs = struct.unpack('>{}H'.format(len(data) // 2), data[:len(data) // 2 * 2])
+    chars = [c for n in pairs for c in (n % 45, n // 45 % 45, n // 2025)]
+    if len(data) & 1:
+        chars.extend((data[-1] % 45, data[-1] // 45))
+    return ''.join([BASE45_ALPHABET[c] for c in chars])
+
+
+def base45_decode(text):
+    """Strict RFC 9285 decoding; raises ValueError on any malformed input."""
+    if len(text) % 3 == 1:
+        raise ValueError('invalid base45 length {}'.format(len(text)))
+    values = text.encode('ascii', 'replace').translate(_BASE45_VALUES)
+    if 0xff in values:
+        raise ValueError('invalid base45 character {!r}'.format(text[values.index(0xff)]))
+    full = len(values) // 3 * 3
+    pairs = [a + 45 * b + 2025 * c for a, b, c in zip(values[0:full:3], values[1:full:3], values[2:full:3])]
+    if pairs and max(pairs) > 0xffff:
+        raise ValueError('invalid base45 group at {}'.format(3 * next(i for i, n in enumerate(pairs) if n > 0xffff)))
+    data = struct.pack('>{}H'.format(len(pairs)), *pairs)
+    if full < len(values):
+        n = values[full] + 45 * values[full + 1]
+        if n > 0xff:
+            raise ValueError('invalid base45 group at {}'.format(full))
+        data += bytes([n])
+    return data
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""The wallet database: models, sessions, the writer thread and the queries the screens use.
+
+Kept out of main.py so the UI starts without loading SQLAlchemy; main
+imports this module the first time a screen needs wallet data.
+"""
+import os
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy import and_, Column, Integer, Float, String, Boolean
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from bsv_mini import bsv
+from db import DBWriter, create_wallet_engine
+from migrations import migrate
+
+Base = declarative_base()
+
+# The schema itself is created and upgraded by migrations.py; the indexes are listed here to match it.
+
+class UTXO(Base):
+    __tablename__ = 'utxo'
+    __table_args__ = (sqlalchemy.schema.UniqueConstraint('txid', 'txindex', name='uix_1'),
+                      sqlalchemy.Index('ix_utxo_privatekey', 'PrivateKey'))
+ 
+    id = Column(Integer, primary_key=True)
+    PrivateKey = Column(String)
+    txid = Column(String)
+    txindex = Column(Integer)
+    confirmations = Column(Integer)
+    amount = Column(Integer)
+
+class PrivateKeyList(Base):
+    __tablename__ = 'privatekey'
+    __table_args__ = (sqlalchemy.Index('ix_privatekey_privatekey', 'PrivateKey'),
+                      sqlalchemy.Index('ix_privatekey_address', 'Address'),
+                      sqlalchemy.Index('ix_privatekey_active', 'is_activated', sqlite_where=sqlalchemy.text('is_activated = 1')))
+
+    id = Column(Integer, primary_key=True)
+    PrivateKey = Column(String)
+    Address = Column(String)
+    is_activated = Column(Boolean, unique=False)
+    PublicKey = Column(String)  # compressed, hex
+    PublicKeyHash = Column(String)  # hash160 of PublicKey, hex
+
+class AddressSyncState(Base):
+    __tablename__ = 'addresssync'
+
+    id = Column(Integer, primary_key=True)
+    Address = Column(String, unique=True)
+    utxo_hash = Column(String)  # sync.utxo_set_hash of the last fetched UTXO set
+    last_sync = Column(Float)  # unix time of the last fetch
+    last_change = Column(Float)  # unix time the UTXO set last changed
+    is_dirty = Column(Boolean, unique=False)  # touched locally since last_sync
+
+class WalletBalance(Base):
+    # Single row (id 1) kept equal to SUM(utxo.amount) by the triggers in migrations.py.
+    __tablename__ = 'walletbalance'
+
+    id = Column(Integer, primary_key=True)
+    amount = Column(Integer)
+    count = Column(Integer)
+
+OUTBOX_PENDING = 'pending'
+OUTBOX_FAILED = 'failed'
+
+class Outbox(Base):
+    __tablename__ = 'outbox'
+    __table_args__ = (sqlalchemy.Index('ix_outbox_due', 'status', 'next_attempt'),)
+
+    id = Column(Integer, primary_key=True)
+    txid = Column(String, unique=True)
+    rawtx = Column(String)
+    Addresses = Column(String)  # comma separated wallet addresses whose UTXOs the tx changes
+    status = Column(String)  # OUTBOX_PENDING, broadcast.SENT or OUTBOX_FAILED
+    attempts = Column(Integer)
+    next_attempt = Column(Float)  # unix time
+    last_error = Column(String)
+
+class TxHistory(Base):
+    __tablename__ = 'txhistory'
+    __table_args__ = (sqlalchemy.Index('uix_txhistory_txid', 'txid', unique=True),)
+    
+    id = Column(Integer, primary_key=True)
+    txid = Column(String)
+    amount = Column(Integer)
+    rawtx = Column(String)
+    is_recieved = Column(Boolean, unique=False)  #True : Recieve  False: Pay
+
+
+app_path = os.path.dirname(os.path.abspath(__file__))
+wallet_path = os.path.join(app_path, 'simplewallet.sqlite3')
+engine = None
+Session = sessionmaker()
+_open_lock = threading.Lock()
+
+def open_wallet():
+    """Opens the wallet database on first use, creating or migrating it as needed."""
+    global engine
+    with _open_lock:
+        if engine is None:
+            is_new_wallet = not os.path.exists(wallet_path)
+            wallet_engine = create_wallet_engine(wallet_path)
+            migrate(wallet_engine)
+            Session.configure(bind=wallet_engine)
+            if is_new_wallet:
+                init_db()
+            engine = wallet_engine
+    return engine
+
+def new_session():
+    open_wallet()
+    return Session()
+
+# The calling thread's read session, opened on first use; writes go through db_writer.
+session = scoped_session(new_session)
+db_writer = DBWriter(new_session)
+_writer_lock = threading.Lock()
+
+def get_db_writer():
+    """The writer thread, started on first use."""
+    with _writer_lock:
+        if db_writer.ident is None:
+            db_writer.start()
+    return db_writer
+def new_key_row(prik, is_activated=True):
+    return {'PrivateKey': prik.to_wif(),'Address': prik.address,'is_activated': is_activated,
+            'PublicKey': prik.public_key,'PublicKeyHash': prik.to_public_key_hash().hex()}
+
+def init_db():
+    ini_prik = bsv()
+    with Session() as db:
+        db.bulk_insert_mappings(PrivateKeyList,[new_key_row(ini_prik)])
+        db.commit()
+
+
+def mark_dirty(addresses, db=None):
+    # Addresses touched locally are refetched on the next resync.
+    (db or session).query(AddressSyncState).filter(AddressSyncState.Address.in_(list(addresses))).update(
+        {AddressSyncState.is_dirty: True}, synchronize_session=False)
+
+def enqueue_broadcast(db, output, addresses):
+    # Added to the caller's transaction, so the outbox row commits together with its UTXO/history changes.
+    if db.query(Outbox.id).filter_by(txid=output['txid']).first() is None:
+        db.add(Outbox(txid=output['txid'], rawtx=output['rawtx'], Addresses=','.join(sorted(set(addresses))),
+                           status=OUTBOX_PENDING, attempts=0, next_attempt=time.time()))
+
+def pending_addresses(db=None):
+    addresses = set()
+    for row in (db or session).query(Outbox.Addresses).filter_by(status=OUTBOX_PENDING):
+        addresses.update(row.Addresses.split(','))
+    return addresses
+
+
+class OutboxStore:
+    """Outbox persistence for the broadcast worker: reads on its own session, writes through ``writer``."""
+
+    def __init__(self, session_factory, writer):
+        self.session_factory = session_factory
+        self.writer = writer
+
+    def due(self, now, limit):
+        db = self.session_factory()
+        try:
+            return db.query(Outbox.txid, Outbox.rawtx).filter(Outbox.status == OUTBOX_PENDING, Outbox.next_attempt <= now).order_by(
+                Outbox.next_attempt).limit(limit).all()
+        finally:
+            db.close()
+
+    def next_due(self):
+        db = self.session_factory()
+        try:
+            return db.query(sqlalchemy.func.min(Outbox.next_attempt)).filter(Outbox.status == OUTBOX_PENDING).scalar()
+        finally:
+            db.close()
+
+    def record(self, statuses, now):
+        self.writer.submit(self._record, statuses, now).result()
+
+    @staticmethod
+    def _record(db, statuses, now):
+        from broadcast import BROADCAST_MAX_ATTEMPTS, FAILED, SENT, retry_delay
+        dirty = set()
+        for row in db.query(Outbox).filter(Outbox.txid.in_(list(statuses))):
+            status, description = statuses[row.txid]
+            row.attempts += 1
+            if status == SENT:
+                row.status = SENT
+                row.last_error = None
+                dirty.update(row.Addresses.split(','))
+                continue
+            row.last_error = description
+            if status != FAILED and row.attempts < BROADCAST_MAX_ATTEMPTS:
+                row.next_attempt = now + retry_delay(row.attempts)
+                continue
+            # Given up: drop what the tx added locally and let resync restore what it spent.
+            row.status = OUTBOX_FAILED
+            db.query(UTXO).filter_by(txid=row.txid).delete(synchronize_session=False)
+            db.query(TxHistory).filter_by(txid=row.txid).delete(synchronize_session=False)
+            dirty.update(row.Addresses.split(','))
+        mark_dirty(dirty, db)
+
+broadcast_worker = None
+_worker_lock = threading.Lock()
+
+def get_broadcast_worker():
+    """The running broadcast worker, started on first use."""
+    global broadcast_worker
+    with _worker_lock:
+        if broadcast_worker is None:
+            from broadcast import BroadcastWorker
+            broadcast_worker = BroadcastWorker(OutboxStore(new_session, get_db_writer()))
+            broadcast_worker.start()
+    return broadcast_worker
+
+def close():
+    """Stops whichever background threads were started."""
+    if broadcast_worker is not None:
+        broadcast_worker.stop()
+    if db_writer.ident is not None:
+        db_writer.stop()
+
+def get_spendable_utxos(db=None):
+    # Joined with PrivateKeyList so signing reuses the stored public key instead of deriving it.
+    result = (db or session).query(UTXO, PrivateKeyList.PublicKey, PrivateKeyList.PublicKeyHash).outerjoin(
+        PrivateKeyList, PrivateKeyList.PrivateKey == UTXO.PrivateKey).all()
+    utxosets = []
+    for utxo, public_key, public_key_hash in result:
+        item = utxo.__dict__.copy()
+        item['PublicKey'] = public_key
+        item['PublicKeyHash'] = public_key_hash
+        utxosets.append(item)
+    return utxosets
+
+
+# Write jobs, run by db_writer as func(db, *args); the writer commits.
+
+def rotate_receive_key(db):
+    result = db.query(PrivateKeyList).filter_by(is_activated=True).one()
+    result.is_activated = False
+    prik = bsv()
+    db.bulk_insert_mappings(PrivateKeyList,[new_key_row(prik)])
+    mark_dirty([result.Address], db)
+    return prik.address
+
+def ingest_deposits(db, utxosets, private_key):
+    """Stores received UTXOs for ``private_key`` in one statement; returns the ones that were new.
+
+    Outpoints already in the wallet are skipped by the database, and each new
+    transaction gets one history row carrying the sum of its new outputs.
+    """
+    rows = [{'PrivateKey': private_key, 'txid': item['txid'], 'txindex': item['txindex'],
+             'amount': item['amount'], 'confirmations': item.get('confirmations', 0)} for item in utxosets]
+    if not rows:
+        return []
+    new = db.execute(sqlite_insert(UTXO).on_conflict_do_nothing(index_elements=['txid', 'txindex']).returning(
+        UTXO.txid, UTXO.txindex, UTXO.amount), rows).all()
+    received = {}
+    for txid, _, amount in new:
+        received[txid] = received.get(txid, 0) + amount
+    if received:
+        db.execute(sqlite_insert(TxHistory).on_conflict_do_nothing(index_elements=['txid']),
+                   [{'txid': txid, 'amount': amount, 'is_recieved': True} for txid, amount in received.items()])
+    return [{'txid': txid, 'txindex': txindex, 'amount': amount} for txid, txindex, amount in new]
+
+def apply_resync(db, due, unspents, now):
+    """Applies fetched UTXO sets for ``due`` (private key, address) pairs as a diff and moves their cursors.
+
+    Addresses with a pending broadcast are skipped and keep their state: a
+    payment queued while the sets were being fetched is not on chain yet.
+    """
+    from sync import utxo_set_hash, diff_utxos
+    pending = pending_addresses(db)
+    states = {state.Address: state for state in db.query(AddressSyncState).filter(
+        AddressSyncState.Address.in_([address for _, address in due]))}
+    rows = []
+    removed = []
+    for prik, address in due:
+        if address in pending:
+            continue
+        fetched = unspents.get(address, [])
+        digest = utxo_set_hash(fetched)
+        state = states.get(address)
+        if state is None:
+            state = AddressSyncState(Address=address)
+            db.add(state)
+        # A dirty address is diffed even when the fetched set is unchanged: local writes (a payment
+        # whose broadcast later failed) may have moved the wallet away from it.
+        if state.is_dirty or state.utxo_hash != digest:
+            current = db.query(UTXO.id, UTXO.txid, UTXO.txindex).filter_by(PrivateKey=prik).all()
+            inserts, removes = diff_utxos(current, fetched)
+            for item in inserts:
+                item['PrivateKey'] = prik
+            rows.extend(inserts)
+            removed.extend(removes)
+            state.utxo_hash = digest
+            state.last_change = now
+        state.last_sync = now
+        state.is_dirty = False
+    if removed:
+        db.query(UTXO).filter(UTXO.id.in_(removed)).delete(synchronize_session=False)
+    db.bulk_insert_mappings(UTXO, rows)
+    return len(rows), len(removed)
+
+def record_payment(db, output, spent, addresses):
+    # Spent outputs go, the change output and history row come in, and the tx is queued for broadcast.
+    # An outpoint that is already gone was spent by another payment (or by resync): raising rolls this one back.
+    for txid, txindex in spent:
+        if not db.query(UTXO).filter(and_(UTXO.txid==txid,UTXO.txindex==txindex)).delete():
+            raise ValueError('{}:{} is already spent'.format(txid, txindex))
+    if output['utxoset']:
+        db.bulk_insert_mappings(UTXO,[output['utxoset']])
+    if db.query(TxHistory.id).filter_by(txid=output['txid']).first() is None:
+        db.bulk_insert_mappings(TxHistory,[output])
+    enqueue_broadcast(db, output, addresses)
+    return output['txid']
+
+def get_balance(db=None):
+    # O(1): the running total maintained by the utxo_balance_* triggers.
+    return (db or session).query(WalletBalance.amount).filter_by(id=1).scalar() or 0
+
+
+def address_page(last_id, limit, prefix='', db=None):
+    """Up to ``limit`` addresses older than ``last_id``, newest first, with UTXO count and balance.
+
+    One LEFT JOIN ... GROUP BY query; ``prefix`` filters on the start of the address.
+    """
+    query = (db or session).query(
+        PrivateKeyList.id, PrivateKeyList.Address,
+        sqlalchemy.func.count(UTXO.id).label('utxos'),
+        sqlalchemy.func.coalesce(sqlalchemy.func.sum(UTXO.amount), 0).label('balance')).outerjoin(
+        UTXO, UTXO.PrivateKey == PrivateKeyList.PrivateKey)
+    if last_id is not None:
+        query = query.filter(PrivateKeyList.id < last_id)
+    if prefix:
+        # A range rather than LIKE, which ignores case and base58 does not.
+        query = query.filter(PrivateKeyList.Address >= prefix,
+                             PrivateKeyList.Address < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    query = query.group_by(PrivateKeyList.id).order_by(PrivateKeyList.id.desc()).limit(limit)
+    return [row._asdict() for row in query]
+
+HISTORY_COLUMNS = (TxHistory.id, TxHistory.txid, TxHistory.amount, TxHistory.is_recieved)
+
+def history_before(last_id, limit, db=None):
+    """Up to ``limit`` history rows older than ``last_id``, newest first."""
+    query = (db or session).query(*HISTORY_COLUMNS)
+    if last_id is not None:
+        query = query.filter(TxHistory.id < last_id)
+    return [row._asdict() for row in query.order_by(TxHistory.id.desc()).limit(limit)]
+
+def history_after(first_id, db=None):
+    """History rows newer than ``first_id``, newest first."""
+    query = (db or session).query(*HISTORY_COLUMNS).filter(TxHistory.id > first_id)
+    return [row._asdict() for row in query.order_by(TxHistory.id.desc())]
+
+def get_recieve_address():
+    result = session.query(PrivateKeyList).filter_by(is_activated=True).one()
+    return result.Address